@@ -1,28 +1,186 @@
+import asyncio
+import anyio
+import logging
 import os
+from contextlib import asynccontextmanager
+from datetime import timedelta
 from dotenv import load_dotenv
 
+from mcp import types
+from mcp.client.session import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
 from llama_index.tools.mcp import McpToolSpec, BasicMCPClient
 from llama_index.core.agent.workflow import FunctionAgent
 from llama_index.llms.openai import OpenAI
+from opentelemetry.trace import get_tracer
+from typing import Any, AsyncIterator, Optional, Tuple
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+TRACER = get_tracer(__name__)
+
+
+class PersistentMCPClient(BasicMCPClient):
+    """
+    MCP client (over streamable HTTP) that keeps one session open for all its
+    calls, instead of opening a new one for each like `BasicMCPClient`.
+
+    The session lives in its own task and is pinged every `keepalive_interval`
+    seconds. If the ping or a call fails because the connection is gone, the
+    session is reopened on the next call. `tools_version` is bumped whenever
+    the server notifies that its list of tools changed.
+    """
+
+    def __init__(self, command_or_url: str, keepalive_interval: float = 30, **kwargs):
+        super().__init__(command_or_url, **kwargs)
+        self.keepalive_interval = keepalive_interval
+        self.tools_version = 0
+        self.sessions_opened = 0
+        self._session: Optional[ClientSession] = None
+        self._session_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def _open_session(self) -> AsyncIterator[ClientSession]:
+        async with streamablehttp_client(
+            self.command_or_url, auth=self.auth, headers=self.headers
+        ) as (read, write, _):
+            async with ClientSession(
+                read,
+                write,
+                read_timeout_seconds=timedelta(seconds=self.timeout),
+                sampling_callback=self.sampling_callback,
+                message_handler=self._handle_message,
+            ) as session:
+                await session.initialize()
+                self.sessions_opened += 1
+                yield session
+
+    async def _handle_message(self, message: Any) -> None:
+        if isinstance(message, types.ServerNotification) and isinstance(
+            message.root, types.ToolListChangedNotification
+        ):
+            self.tools_version += 1
+
+    async def _keep_session(self, ready: asyncio.Future) -> None:
+        # The transport must be opened and closed by the same task
+        try:
+            async with self._open_session() as session:
+                self._session = session
+                ready.set_result(session)
+                while True:
+                    await asyncio.sleep(self.keepalive_interval)
+                    await session.send_ping()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(
+                    ConnectionError(
+                        f"Could not reach the MCP server at {self.command_or_url}"
+                    )
+                )
+            else:
+                logger.warning("MCP session to %s closed: %s", self.command_or_url, e)
+        finally:
+            self._session = None
+
+    async def session(self) -> Tuple[ClientSession, asyncio.Task]:
+        async with self._lock:
+            if self._session is None:
+                ready = asyncio.get_running_loop().create_future()
+                self._session_task = asyncio.create_task(self._keep_session(ready))
+                await ready
+            if self._session is None or self._session_task is None:
+                # Closed again right after it was opened
+                raise ConnectionError(f"Lost the MCP session to {self.command_or_url}")
+            return self._session, self._session_task
+
+    async def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        for attempt in range(2):
+            session, session_task = await self.session()
+            call = asyncio.ensure_future(getattr(session, method)(*args, **kwargs))
+            try:
+                await asyncio.wait(
+                    {call, session_task}, return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                if not call.done():
+                    call.cancel()
+                    await asyncio.gather(call, return_exceptions=True)
+            try:
+                if not call.cancelled():
+                    return call.result()
+            except (anyio.ClosedResourceError, anyio.BrokenResourceError):
+                pass
+            # The server went away since the last call: retry on a new session
+            if attempt == 0:
+                session_task.cancel()
+                await asyncio.gather(session_task, return_exceptions=True)
+        raise ConnectionError(f"Lost the MCP session to {self.command_or_url}")
+
+    async def call_tool(
+        self,
+        tool_name: str,
+        arguments: Optional[dict] = None,
+        progress_callback: Any = None,
+    ) -> types.CallToolResult:
+        # Tagged per the GenAI semantic conventions, so that the tool name gets
+        # its own column in the traces table
+        with TRACER.start_as_current_span(f"execute_tool {tool_name}") as span:
+            span.set_attribute("gen_ai.operation.name", "execute_tool")
+            span.set_attribute("gen_ai.tool.name", tool_name)
+            return await self._call(
+                "call_tool",
+                tool_name,
+                arguments=arguments,
+                progress_callback=progress_callback,
+            )
+
+    async def list_tools(self) -> types.ListToolsResult:
+        return await self._call("list_tools")
+
+    async def aclose(self) -> None:
+        if self._session_task is not None:
+            self._session_task.cancel()
+            await asyncio.gather(self._session_task, return_exceptions=True)
+
+
 llm = OpenAI(model="gpt-4.1", api_key=os.getenv("OPENAI_API_KEY"))
-mcp_client = BasicMCPClient(command_or_url="http://localhost:8000/mcp")
-tool_spec = McpToolSpec(client=mcp_client)
-tools = tool_spec.to_tool_list()
-
-agent = FunctionAgent(
-    name="SyllabusAgent",
-    description="Agent to extract information about course syllabus and to answer questions about it.",
-    tools=tools,
-    system_prompt="""
+mcp_client = PersistentMCPClient(
+    command_or_url=os.getenv("MCP_SERVER_URL", "http://localhost:8000/mcp")
+)
+
+SYSTEM_PROMPT = """
     You are SyllabusAgent. You have two main tasks:
     1. Extract information from a syllabus file (in PDF format) and return a summary of that information to the user. Use the 'syllabus_extractor_tool' for this task. Always report to the user the information you extracted in a human-readable format.
-    2. Answer questions about courses syllabi. Use the 'answer_questions_tool' for this task. Always report the answer to the user.
+    2. Answer questions about courses syllabi. Use the 'answer_questions_tool' for this task, passing the paths of the syllabus files the question is about when you know them (e.g. files you just extracted). Always report the answer to the user.
 
     Choose the tools based on the task you are asked to perfom.
-    """,
-    llm=llm,
-    timeout=600,
-)
+    """
+
+_agent: Optional[FunctionAgent] = None
+_agent_tools_version = -1
+_agent_lock = asyncio.Lock()
+
+
+async def get_agent() -> FunctionAgent:
+    """
+    Returns the agent, discovering the MCP tools on first use instead of at
+    import time. The tools are fetched again after the MCP server notifies
+    that they changed.
+    """
+    global _agent, _agent_tools_version
+    async with _agent_lock:
+        if _agent is None or _agent_tools_version != mcp_client.tools_version:
+            version = mcp_client.tools_version
+            tools = await McpToolSpec(client=mcp_client).to_tool_list_async()
+            _agent = FunctionAgent(
+                name="SyllabusAgent",
+                description="Agent to extract information about course syllabus and to answer questions about it.",
+                tools=tools,
+                system_prompt=SYSTEM_PROMPT,
+                llm=llm,
+                timeout=600,
+            )
+            _agent_tools_version = version
+        return _agent
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from typing import Tuple
+
+# Pointer jumping doubles the distance covered each round, so 64 rounds reach
+# the root of any tree; it also bounds the work on (corrupt) cyclic parents
+_MAX_JUMPS = 64
+
+
+def _parent_positions(spans: pd.DataFrame) -> np.ndarray:
+    # Hash span and parent ids to shared integer codes, so (trace, span) pairs
+    # become single int64 keys that can be looked up in one pass
+    n = len(spans)
+    trace_codes, _ = pd.factorize(spans["trace_id"].to_numpy(dtype=object))
+    span_codes, uniques = pd.factorize(
+        np.concatenate(
+            [
+                spans["span_id"].to_numpy(dtype=object),
+                spans["parent_span_id"].to_numpy(dtype=object),
+            ]
+        )
+    )
+    keys = trace_codes.astype("int64") * (len(uniques) + 1) + span_codes[:n]
+    parent_keys = trace_codes.astype("int64") * (len(uniques) + 1) + span_codes[n:]
+    positions = pd.Index(keys).get_indexer(parent_keys)
+    # Spans without a parent, or whose parent was never stored, are roots
+    positions[(span_codes[n:] < 0) | (positions == np.arange(n))] = -1
+    return positions
+
+
+def _jump(
+    parent: np.ndarray, flag: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Root, depth, and whether `flag` holds on every span up to the root, for all
+    spans at once.
+    """
+    up = np.where(parent >= 0, parent, np.arange(len(parent)))
+    depth = (parent >= 0).astype("int64")
+    flag = flag.copy()
+    for _ in range(_MAX_JUMPS):
+        next_up = up[up]
+        if np.array_equal(next_up, up):
+            break
+        depth = depth + depth[up]
+        flag = flag & flag[up]
+        up = next_up
+    return up, depth, flag
+
+
+def _covered_time(parent: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Time of each span covered by at least one of its children."""
+    child = np.flatnonzero(parent >= 0)
+    owner = parent[child]
+    # Only the part of a child inside its parent counts
+    child_start = np.maximum(start[child], start[owner])
+    child_end = np.maximum(np.minimum(end[child], end[owner]), child_start)
+    order = np.lexsort((child_start, owner))
+    owner, child_start, child_end = owner[order], child_start[order], child_end[order]
+    # Concurrent children overlap: only count what earlier siblings left uncovered
+    reached = pd.Series(child_end).groupby(owner).cummax()
+    reached = reached.groupby(owner).shift(1).fillna(0).to_numpy(dtype="int64")
+    covered = np.maximum(child_end - np.maximum(child_start, reached), 0)
+    return np.bincount(owner, weights=covered, minlength=len(parent)).astype("int64")
+
+
+def _last_child(parent: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Position of the child of each span that finished last (-1 for leaves)."""
+    child = np.flatnonzero(parent >= 0)
+    order = np.lexsort((end[child], parent[child]))
+    owner, child = parent[child][order], child[order]
+    last = np.r_[owner[1:] != owner[:-1], True] if len(owner) else owner.astype(bool)
+    last_child = np.full(len(parent), -1)
+    last_child[owner[last]] = child[last]
+    return last_child
+
+
+def build_span_tree(spans: pd.DataFrame) -> pd.DataFrame:
+    """
+    Links every span to its parent and annotates it with:
+
+    - `depth`: number of ancestors
+    - `children`: number of direct children (fan-out)
+    - `self_time`: duration not covered by any child, in microseconds
+    - `on_critical_path`: whether the span is on the chain of last-finishing
+      children starting at the root, i.e. the spans the trace waited on
+    """
+    tree = spans.drop_duplicates(subset=["trace_id", "span_id"], keep="last")
+    tree = tree.reset_index(drop=True)
+    parent = _parent_positions(tree)
+    start = tree["start_time"].to_numpy(dtype="int64")
+    end = start + tree["duration"].to_numpy(dtype="int64")
+    positions = np.arange(len(tree))
+    last_child = _last_child(parent, end)
+    is_last_child = (parent < 0) | (last_child[np.maximum(parent, 0)] == positions)
+    root, depth, on_critical_path = _jump(parent, is_last_child)
+    return tree.assign(
+        root_span_id=tree["span_id"].to_numpy(dtype=object)[root],
+        depth=depth,
+        children=np.bincount(parent[parent >= 0], minlength=len(tree)),
+        self_time=end - start - _covered_time(parent, start, end),
+        on_critical_path=on_critical_path,
+    )
+
+
+def critical_path(tree: pd.DataFrame, trace_id: str) -> pd.DataFrame:
+    """The critical path of one trace, from the root down, as built by `build_span_tree`."""
+    path = tree[(tree["trace_id"] == trace_id) & tree["on_critical_path"]]
+    return path.sort_values(["root_span_id", "depth"]).reset_index(drop=True)
+
+
+def trace_summary(tree: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per trace: span count, depth, widest fan-out, wall-clock duration,
+    its critical path and the operation with the most self-time on it.
+    """
+    end = tree["start_time"] + tree["duration"]
+    summary = (
+        tree.assign(end_time=end)
+        .groupby("trace_id", observed=True)
+        .agg(
+            spans=("span_id", "size"),
+            depth=("depth", "max"),
+            max_fan_out=("children", "max"),
+            start_time=("start_time", "min"),
+            end_time=("end_time", "max"),
+        )
+    )
+    summary["duration"] = summary.pop("end_time") - summary["start_time"]
+    path = tree[tree["on_critical_path"]].sort_values(
+        ["trace_id", "root_span_id", "depth"]
+    )
+    operations = path["operation_name"].astype(str)
+    summary["critical_path"] = operations.groupby(path["trace_id"]).agg(" > ".join)
+    heaviest = path.loc[path.groupby("trace_id", observed=True)["self_time"].idxmax()]
+    summary["dominant_operation"] = heaviest.set_index("trace_id")["operation_name"]
+    summary["dominant_self_time"] = heaviest.set_index("trace_id")["self_time"]
+    return summary.sort_values("start_time", ascending=False).reset_index()
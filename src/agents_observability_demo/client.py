@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+
+from typing import Any, AsyncIterator, Dict, List, Optional
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+from websockets.protocol import State
+
+logger = logging.getLogger(__name__)
+
+
+class AgentError(Exception):
+    """The agent server failed to run a request."""
+
+
+class _PooledConnection:
+    """
+    One long-lived websocket connection, shared by several requests. A reader
+    task routes every frame to the queue of the request it belongs to.
+    """
+
+    def __init__(self, client: "AgentClient") -> None:
+        self.client = client
+        self.websocket: Optional[ClientConnection] = None
+        self.requests: Dict[str, asyncio.Queue] = {}
+        self._reader: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.websocket is not None and self.websocket.state is State.OPEN
+
+    async def ensure_open(self) -> ClientConnection:
+        async with self._lock:
+            websocket = self.websocket
+            if websocket is None or websocket.state is not State.OPEN:
+                websocket = self.websocket = await self.client._connect()
+                self._reader = asyncio.create_task(self._read(websocket))
+            return websocket
+
+    async def _read(self, websocket: ClientConnection) -> None:
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                queue = self.requests.get(message.get("id"))
+                if queue is not None:
+                    queue.put_nowait(message)
+        except ConnectionClosed:
+            pass
+        finally:
+            # The requests in flight on this connection cannot be resumed
+            for queue in self.requests.values():
+                queue.put_nowait(None)
+
+    async def close(self) -> None:
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+
+class AgentClient:
+    """
+    Client for the agent websocket server, keeping a pool of `pool_size`
+    connections open across requests. Each request goes to the least busy
+    connection; the server runs the requests of a connection concurrently
+    (see protocol.py for the frames exchanged).
+
+    Idle connections are health-checked with ping/pong every `ping_interval`
+    seconds and dropped when no pong comes back within `ping_timeout`. Dropped
+    connections are reopened on the next request, retrying up to
+    `max_attempts` times with exponential backoff (with jitter) capped at
+    `max_backoff` seconds.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        pool_size: int = 2,
+        ping_interval: float = 20,
+        ping_timeout: float = 20,
+        max_attempts: int = 5,
+        initial_backoff: float = 0.5,
+        max_backoff: float = 10,
+    ):
+        self.uri = uri
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.connections: List[_PooledConnection] = [
+            _PooledConnection(self) for _ in range(pool_size)
+        ]
+        self.connects = 0
+
+    async def _connect(self) -> ClientConnection:
+        delay = self.initial_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                websocket = await connect(
+                    self.uri,
+                    ping_interval=self.ping_interval,
+                    ping_timeout=self.ping_timeout,
+                )
+                self.connects += 1
+                return websocket
+            except OSError as e:
+                if attempt == self.max_attempts:
+                    raise ConnectionError(
+                        f"Could not connect to {self.uri} after {attempt} attempts: {e}"
+                    ) from e
+                logger.warning(
+                    "Connection to %s failed (%s), retrying in %.1fs",
+                    self.uri,
+                    e,
+                    delay,
+                )
+                await asyncio.sleep(delay * random.uniform(0.5, 1))
+                delay = min(delay * 2, self.max_backoff)
+        raise ConnectionError(f"Could not connect to {self.uri}")
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Runs the agent on `prompt`, yielding the chunks of its response. The
+        request is cancelled on the server if the caller stops iterating.
+        """
+        connection = min(self.connections, key=lambda c: len(c.requests))
+        request_id = uuid.uuid4().hex
+        queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
+        connection.requests[request_id] = queue
+        finished = False
+        try:
+            websocket = await connection.ensure_open()
+            await websocket.send(
+                json.dumps({"type": "run", "id": request_id, "prompt": prompt})
+            )
+            while True:
+                message = await queue.get()
+                if message is None:
+                    finished = True
+                    raise ConnectionError(f"Connection to {self.uri} was lost")
+                if message["type"] == "chunk":
+                    yield message["content"]
+                    continue
+                finished = True
+                if message["type"] == "error":
+                    raise AgentError(message["error"])
+                if message["type"] == "cancelled":
+                    raise AgentError("Request was cancelled by the server")
+                return
+        except ConnectionClosed as e:
+            finished = True
+            raise ConnectionError(f"Connection to {self.uri} was lost") from e
+        finally:
+            del connection.requests[request_id]
+            current = connection.websocket
+            if not finished and current is not None and current.state is State.OPEN:
+                try:
+                    await current.send(json.dumps({"type": "cancel", "id": request_id}))
+                except ConnectionClosed:
+                    pass
+
+    async def close(self) -> None:
+        await asyncio.gather(*(connection.close() for connection in self.connections))
+
+
+_CLIENTS: Dict[asyncio.AbstractEventLoop, AgentClient] = {}
+
+
+def get_agent_client() -> AgentClient:
+    """
+    Returns the client shared by the whole process (one per event loop). The
+    server is read from `AGENT_WS_URI` and the pool size from
+    `AGENT_WS_POOL_SIZE`.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _CLIENTS:
+        _CLIENTS[loop] = AgentClient(
+            uri=os.getenv("AGENT_WS_URI", "ws://localhost:8765"),
+            pool_size=int(os.getenv("AGENT_WS_POOL_SIZE", "2")),
+        )
+    return _CLIENTS[loop]
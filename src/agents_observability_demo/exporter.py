@@ -0,0 +1,100 @@
+import logging
+
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence
+from opentelemetry.sdk.resources import SERVICE_NAME
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.trace import StatusCode
+
+if TYPE_CHECKING:
+    from utils import OtelTracesSqlEngine
+
+logger = logging.getLogger(__name__)
+
+
+def _format_trace_id(trace_id: int) -> str:
+    # Same rendering as Jaeger, so both ingestion paths produce the same keys
+    if trace_id >> 64:
+        return f"{trace_id:032x}"
+    return f"{trace_id:016x}"
+
+
+def _to_jaeger_trace(span: ReadableSpan) -> Dict[str, Any]:
+    trace_id = _format_trace_id(span.context.trace_id)
+    tags: List[Dict[str, Any]] = [
+        {"key": key, "value": value} for key, value in (span.attributes or {}).items()
+    ]
+    if span.status.status_code is not StatusCode.UNSET:
+        tags.append({"key": "otel.status_code", "value": span.status.status_code.name})
+    references = []
+    if span.parent is not None:
+        references.append(
+            {
+                "refType": "CHILD_OF",
+                "traceID": trace_id,
+                "spanID": f"{span.parent.span_id:016x}",
+            }
+        )
+    # Jaeger keeps the event name in an "event" field of the log
+    logs = [
+        {
+            "timestamp": event.timestamp // 1000,
+            "fields": [{"key": "event", "value": event.name}]
+            + [
+                {"key": key, "value": value}
+                for key, value in (event.attributes or {}).items()
+            ],
+        }
+        for event in span.events
+    ]
+    start_time = span.start_time or 0
+    end_time = span.end_time or start_time
+    return {
+        "traceID": trace_id,
+        "processes": {
+            "p1": {"serviceName": span.resource.attributes.get(SERVICE_NAME, "")}
+        },
+        "spans": [
+            {
+                "spanID": f"{span.context.span_id:016x}",
+                "operationName": span.name,
+                "startTime": start_time // 1000,
+                "duration": (end_time - start_time) // 1000,
+                "processID": "p1",
+                "references": references,
+                "tags": tags,
+                "logs": logs,
+            }
+        ],
+    }
+
+
+class SqlSpanExporter(SpanExporter):
+    """
+    Span exporter that writes finished spans straight into the traces table.
+
+    Spans are converted to the Jaeger JSON layout and go through the same
+    `OtelTracesSqlEngine` upsert as traces synced from Jaeger, so the two
+    ingestion paths can run side by side without duplicating rows.
+    """
+
+    def __init__(self, sql_engine: "OtelTracesSqlEngine"):
+        self.sql_engine = sql_engine
+        self._shutdown = False
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        if self._shutdown:
+            return SpanExportResult.FAILURE
+        data = {"data": [_to_jaeger_trace(span) for span in spans]}
+        try:
+            self.sql_engine.upsert_traces(data)
+        except Exception:
+            logger.exception("Failed to export %d spans to SQL", len(spans))
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        self._shutdown = True
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
@@ -0,0 +1,372 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    TypeVar,
+    cast,
+)
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Connection,
+    Float,
+    Index,
+    MetaData,
+    Table,
+    Text,
+    create_engine,
+    func,
+    select,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _insert(dialect_name: str, table: Table) -> Any:
+    if dialect_name == "postgresql":
+        return postgresql.insert(table)
+    if dialect_name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(
+        f"The extraction cache is not supported on {dialect_name} databases"
+    )
+
+
+class ExtractionCache:
+    """
+    Extraction results stored on disk, keyed by the SHA-256 of the syllabus
+    file and the version of the extraction schema.
+
+    Entries expire `ttl` seconds after they were written, and the least
+    recently used ones are evicted once the results exceed `max_bytes`.
+
+    Which files were added to the index is recorded separately, by file hash
+    only: an extraction can be cached while indexing the file failed.
+    """
+
+    def __init__(
+        self,
+        engine_url: str,
+        ttl: Optional[float] = 30 * 24 * 60 * 60,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._engine = create_engine(url=engine_url)
+        self.table = Table(
+            "extraction_cache",
+            MetaData(),
+            Column("key", Text, primary_key=True),
+            Column("result", Text, nullable=False),
+            Column("size", BigInteger, nullable=False),
+            Column("created_at", Float, nullable=False),
+            Column("accessed_at", Float, nullable=False),
+            Index("ix_extraction_cache_accessed_at", "accessed_at"),
+        )
+        self.indexed = Table(
+            "indexed_files",
+            self.table.metadata,
+            Column("file_digest", Text, primary_key=True),
+            Column("indexed_at", Float, nullable=False),
+        )
+        self.table.metadata.create_all(self._engine)
+
+    @staticmethod
+    def make_key(file_digest: str, schema_version: str) -> str:
+        return f"{schema_version}:{file_digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        table = self.table
+        now = time.time()
+        with self._engine.begin() as connection:
+            row = connection.execute(
+                select(table.c.result, table.c.created_at).where(table.c.key == key)
+            ).one_or_none()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row.created_at >= self.ttl:
+                connection.execute(table.delete().where(table.c.key == key))
+                return None
+            connection.execute(
+                table.update().where(table.c.key == key).values(accessed_at=now)
+            )
+            return cast(str, row.result)
+
+    def put(self, key: str, result: str) -> None:
+        table = self.table
+        now = time.time()
+        values = {
+            "result": result,
+            "size": len(result.encode()),
+            "created_at": now,
+            "accessed_at": now,
+        }
+        with self._engine.begin() as connection:
+            statement = _insert(connection.dialect.name, table).values(
+                key=key, **values
+            )
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[table.c.key], set_=values
+                )
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection: Connection, now: float) -> None:
+        table = self.table
+        if self.ttl is not None:
+            connection.execute(
+                table.delete().where(table.c.created_at < now - self.ttl)
+            )
+        total = connection.execute(
+            select(func.coalesce(func.sum(table.c.size), 0))
+        ).scalar_one()
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in connection.execute(
+            select(table.c.key, table.c.size).order_by(table.c.accessed_at)
+        ):
+            if total <= self.max_bytes:
+                break
+            victims.append(key)
+            total -= size
+        connection.execute(table.delete().where(table.c.key.in_(victims)))
+
+    def is_indexed(self, file_digest: str) -> bool:
+        with self._engine.connect() as connection:
+            return (
+                connection.execute(
+                    select(self.indexed.c.file_digest).where(
+                        self.indexed.c.file_digest == file_digest
+                    )
+                ).first()
+                is not None
+            )
+
+    def mark_indexed(self, file_digest: str) -> None:
+        table = self.indexed
+        with self._engine.begin() as connection:
+            statement = _insert(connection.dialect.name, table).values(
+                file_digest=file_digest, indexed_at=time.time()
+            )
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[table.c.file_digest],
+                    set_={"indexed_at": statement.excluded.indexed_at},
+                )
+            )
+
+    def close(self) -> None:
+        self._engine.dispose()
+
+
+IndexingStatus = Literal["pending", "indexed", "failed"]
+
+
+class BackgroundIndexer:
+    """
+    Adds files to the LlamaCloud pipeline in background tasks.
+
+    Each file is indexed once (keyed by its content hash), and its status can
+    be checked or waited on, so questions can wait for the syllabi that are
+    still being indexed without extractions having to.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._status: Dict[str, IndexingStatus] = {}
+        # Goes up every time a file is added to the index
+        self.version = 0
+
+    def status(self, key: str) -> Optional[IndexingStatus]:
+        return self._status.get(key)
+
+    @property
+    def pending(self) -> int:
+        return sum(not task.done() for task in self._tasks.values())
+
+    def submit(self, key: str, indexing: Awaitable[None]) -> asyncio.Task:
+        """Starts indexing a file, unless it is already indexed or being indexed."""
+        task = self._tasks.get(key)
+        if task is not None and self._status.get(key) != "failed":
+            if asyncio.iscoroutine(indexing):
+                indexing.close()
+            return task
+        self._status[key] = "pending"
+        task = asyncio.create_task(self._run(key, indexing))
+        self._tasks[key] = task
+        return task
+
+    async def _run(self, key: str, indexing: Awaitable[None]) -> None:
+        try:
+            await indexing
+        except Exception:
+            self._status[key] = "failed"
+            logger.exception("Failed to index file %s", key)
+        else:
+            self._status[key] = "indexed"
+            self.version += 1
+
+    async def wait(
+        self, keys: Optional[Iterable[str]] = None, timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Waits for the files being indexed (only those of `keys`, if given),
+        returning False on timeout.
+        """
+        tasks = (
+            self._tasks.values()
+            if keys is None
+            else [self._tasks[key] for key in keys if key in self._tasks]
+        )
+        pending = [task for task in tasks if not task.done()]
+        if not pending:
+            return True
+        _, not_done = await asyncio.wait(pending, timeout=timeout)
+        return not not_done
+
+
+def file_sha256(filename: str) -> str:
+    with open(filename, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class AsyncRateLimiter:
+    """Lets at most `rate` callers per second through `acquire`, evenly spaced."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            wait_for = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait_for > 0:
+            await asyncio.sleep(wait_for)
+
+
+def find_syllabi(paths: List[str]) -> List[str]:
+    """Expands directories into the PDF files they contain."""
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                sorted(
+                    os.path.join(path, name)
+                    for name in os.listdir(path)
+                    if name.lower().endswith(".pdf")
+                )
+            )
+        else:
+            files.append(path)
+    return files
+
+
+async def extract_files(
+    paths: List[str],
+    extract: Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]],
+    max_concurrency: int = 4,
+    rate_limit: Optional[float] = None,
+    on_progress: Optional[Callable[[int, int, str], Awaitable[None]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Runs `extract(file, file_digest)` concurrently on many files (or
+    directories of PDFs).
+
+    Files with the same content are extracted once. At most `max_concurrency`
+    extractions run at a time, starting at most `rate_limit` per second, and
+    `on_progress(done, total, file)` is awaited after each file. Returns one
+    entry per distinct file, with its `data` or `error`; files that can't be
+    read come last, with their `error`.
+    """
+    by_digest: Dict[str, List[str]] = {}
+    unreadable: Dict[str, str] = {}
+    for path in find_syllabi(paths):
+        # A missing or unreadable file only fails its own entry
+        try:
+            digest = await asyncio.to_thread(file_sha256, path)
+        except OSError as e:
+            logger.warning("Failed to read %s: %s", path, e)
+            unreadable[path] = str(e)
+            continue
+        if path not in by_digest.setdefault(digest, []):
+            by_digest[digest].append(path)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    limiter = AsyncRateLimiter(rate_limit) if rate_limit else None
+    total = len(by_digest) + len(unreadable)
+    done = 0
+
+    async def extract_one(digest: Optional[str], files: List[str]) -> Dict[str, Any]:
+        nonlocal done
+        result: Dict[str, Any] = {"file": files[0]}
+        if len(files) > 1:
+            result["duplicates"] = files[1:]
+        if digest is None:
+            result["error"] = unreadable[files[0]]
+        else:
+            async with semaphore:
+                if limiter is not None:
+                    await limiter.acquire()
+                try:
+                    result["data"] = await extract(files[0], digest)
+                except Exception as e:
+                    logger.exception("Failed to extract %s", files[0])
+                    result["error"] = str(e)
+        done += 1
+        if on_progress is not None:
+            await on_progress(done, total, files[0])
+        return result
+
+    return list(
+        await asyncio.gather(
+            *(extract_one(digest, files) for digest, files in by_digest.items()),
+            *(extract_one(None, [path]) for path in unreadable),
+        )
+    )
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time: concurrent callers with the same
+    key await the call already in flight instead of starting their own.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(call())
+            self._calls[key] = future
+
+            def forget(done: asyncio.Future) -> None:
+                if self._calls.get(key) is done:
+                    del self._calls[key]
+
+            future.add_done_callback(forget)
+        # A caller giving up must not cancel the call for everyone else
+        return cast(T, await asyncio.shield(future))
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from utils import OtelTracesSqlEngine
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestionStats:
+    submitted: int = 0
+    dropped: int = 0
+    batches_written: int = 0
+    windows_written: int = 0
+    failed_batches: int = 0
+    last_lag: float = 0.0
+    max_lag: float = 0.0
+
+
+class TraceIngestionService:
+    """
+    Saves traces to the SQL database in the background.
+
+    Finished requests submit their time window, and a single worker coalesces
+    all pending windows into one Jaeger fetch and one bulk write, run in a
+    thread pool (or through the engine's async engine, when it has one) so the
+    event loop is never blocked on network or database I/O.
+    """
+
+    def __init__(
+        self,
+        sql_engine: "OtelTracesSqlEngine",
+        max_queue_size: int = 1000,
+        max_batch_size: int = 100,
+        flush_interval: float = 1.0,
+    ):
+        self.sql_engine = sql_engine
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.stats = IngestionStats()
+        self._queue: asyncio.Queue[Optional[Tuple[int, int, float]]] = asyncio.Queue(
+            maxsize=max_queue_size
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="trace-ingestion"
+        )
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    def submit(self, start_time: int, end_time: int) -> bool:
+        """Queue a time window for ingestion, dropping it if the queue is full."""
+        try:
+            self._queue.put_nowait((start_time, end_time, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            logger.warning("Trace ingestion queue is full, dropping window")
+            return False
+        self.stats.submitted += 1
+        return True
+
+    async def stop(self) -> None:
+        """Flush every pending window, then stop the worker."""
+        if self._worker is not None:
+            await self._queue.put(None)
+            await self._worker
+            self._worker = None
+        self._executor.shutdown(wait=True)
+
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stopping = await self._collect(batch)
+            await self._write(batch)
+            if stopping:
+                return
+
+    async def _collect(self, batch: List[Tuple[int, int, float]]) -> bool:
+        # Give other requests a chance to finish so their windows share one write
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                window = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            if window is None:
+                return True
+            batch.append(window)
+        return False
+
+    async def _write(self, batch: List[Tuple[int, int, float]]) -> None:
+        start_time = min(window[0] for window in batch)
+        end_time = max(window[1] for window in batch)
+        loop = asyncio.get_running_loop()
+        try:
+            if getattr(self.sql_engine, "has_async_engine", False):
+                await self.sql_engine.ato_sql_database(
+                    start_time=start_time, end_time=end_time
+                )
+            else:
+                await loop.run_in_executor(
+                    self._executor,
+                    lambda: self.sql_engine.to_sql_database(
+                        start_time=start_time, end_time=end_time, incremental=True
+                    ),
+                )
+        except Exception:
+            self.stats.failed_batches += 1
+            logger.exception("Failed to save traces for %d windows", len(batch))
+            return
+        lag = time.monotonic() - min(window[2] for window in batch)
+        self.stats.batches_written += 1
+        self.stats.windows_written += len(batch)
+        self.stats.last_lag = lag
+        self.stats.max_lag = max(self.stats.max_lag, lag)
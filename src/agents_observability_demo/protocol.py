@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from websockets.asyncio.server import ServerConnection
+from websockets.exceptions import ConnectionClosed
+
+logger = logging.getLogger(__name__)
+
+# Every frame is a JSON object tagged with the id of the request it belongs to.
+# Client to server:
+#   {"type": "run", "id": ..., "prompt": ...}
+#   {"type": "cancel", "id": ...}
+# Server to client, for each request: any number of
+#   {"type": "chunk", "id": ..., "content": ...}
+# followed by exactly one of
+#   {"type": "end", "id": ...}
+#   {"type": "error", "id": ..., "error": ...}
+#   {"type": "cancelled", "id": ...}
+
+
+def encode_message(type_: str, request_id: Optional[str] = None, **fields: Any) -> str:
+    return json.dumps({"type": type_, "id": request_id, **fields})
+
+
+async def coalesce(
+    chunks: AsyncIterator[str], interval: float = 0.05, max_size: int = 4096
+) -> AsyncIterator[str]:
+    """
+    Merges a stream of small chunks (e.g. LLM token deltas) into fewer, larger
+    ones: at most one chunk per `interval` seconds is yielded, unless the
+    buffered text reaches `max_size` characters first. A chunk arriving after
+    a quiet period is yielded right away, so the first token is not delayed.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = aiter(chunks)
+    buffer: List[str] = []
+    size = 0
+    last_flush = float("-inf")
+    next_chunk: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(anext(iterator))
+            timeout = max(0.0, last_flush + interval - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+            if done:
+                task, next_chunk = next_chunk, None
+                try:
+                    chunk = task.result()
+                except StopAsyncIteration:
+                    break
+                except Exception:
+                    if buffer:
+                        yield "".join(buffer)
+                    raise
+                buffer.append(chunk)
+                size += len(chunk)
+                if size < max_size and loop.time() - last_flush < interval:
+                    continue
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+            last_flush = loop.time()
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        # The source is cancelled along with its consumer
+        if next_chunk is not None:
+            next_chunk.cancel()
+            await asyncio.gather(next_chunk, return_exceptions=True)
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+class MultiplexedConnection:
+    """
+    Serves the requests of one websocket connection, each in its own task.
+
+    At most `max_concurrent_requests` requests of the connection, and at most
+    as many as `global_limit` allows across all connections, run at once; the
+    others wait for a slot. Outgoing frames go through a bounded queue, so a
+    client that reads slowly pauses its own requests instead of buffering
+    their output in memory. Closing the connection cancels its requests.
+    """
+
+    def __init__(
+        self,
+        websocket: ServerConnection,
+        run: Callable[[str], AsyncIterator[str]],
+        global_limit: asyncio.Semaphore,
+        max_concurrent_requests: int = 4,
+        max_pending_messages: int = 64,
+    ):
+        self.websocket = websocket
+        self.run = run
+        self.global_limit = global_limit
+        self.connection_limit = asyncio.Semaphore(max_concurrent_requests)
+        self._outbox: asyncio.Queue[str] = asyncio.Queue(maxsize=max_pending_messages)
+        self._requests: Dict[str, asyncio.Task] = {}
+
+    async def serve(self) -> None:
+        sender = asyncio.create_task(self._send_loop())
+        try:
+            async for raw in self.websocket:
+                await self._handle(raw)
+        except ConnectionClosed:
+            pass
+        finally:
+            # Nobody is left to read the output: stop the work producing it
+            for task in self._requests.values():
+                task.cancel()
+            await asyncio.gather(*self._requests.values(), return_exceptions=True)
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+
+    async def _send_loop(self) -> None:
+        while True:
+            message = await self._outbox.get()
+            try:
+                await self.websocket.send(message)
+            except ConnectionClosed:
+                return
+
+    async def _handle(self, raw: Any) -> None:
+        try:
+            message = json.loads(raw)
+            type_, request_id = message["type"], str(message["id"])
+        except (ValueError, KeyError, TypeError):
+            await self._outbox.put(encode_message("error", error="Invalid message"))
+            return
+        if type_ == "run":
+            if request_id in self._requests:
+                await self._outbox.put(
+                    encode_message("error", request_id, error="Request already running")
+                )
+                return
+            task = asyncio.create_task(
+                self._run_request(request_id, str(message.get("prompt", "")))
+            )
+            self._requests[request_id] = task
+            task.add_done_callback(lambda _: self._requests.pop(request_id, None))
+        elif type_ == "cancel":
+            running = self._requests.get(request_id)
+            if running is not None and running.cancel():
+                # The task stops at its next await: nothing else is sent for it
+                await self._outbox.put(encode_message("cancelled", request_id))
+        else:
+            await self._outbox.put(
+                encode_message("error", request_id, error=f"Unknown type {type_!r}")
+            )
+
+    async def _run_request(self, request_id: str, prompt: str) -> None:
+        try:
+            async with self.connection_limit, self.global_limit:
+                async for chunk in self.run(prompt):
+                    await self._outbox.put(
+                        encode_message("chunk", request_id, content=chunk)
+                    )
+            await self._outbox.put(encode_message("end", request_id))
+        except Exception as e:
+            logger.exception("Request %s failed", request_id)
+            await self._outbox.put(encode_message("error", request_id, error=str(e)))
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from utils import OtelTracesSqlEngine
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetentionPolicy:
+    # Every span is kept this long
+    raw_days: float = 7
+    # Then only the spans of error and slow traces, until this age
+    keep_days: float = 90
+    # A trace is slow when one of its spans lasts this long (in microseconds)
+    slow_threshold: int = 10 * 1000000
+    # Latency rollups per minute and per hour (None keeps them forever)
+    minute_rollup_days: Optional[float] = 7
+    hourly_rollup_days: Optional[float] = None
+    batch_size: int = 5000
+    compact: bool = True
+
+
+@dataclass
+class RetentionReport:
+    spans_deleted: int = 0
+    partitions_dropped: int = 0
+    rollup_rows_deleted: int = 0
+    bytes_reclaimed: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class RetentionStats:
+    runs: int = 0
+    failed_runs: int = 0
+    spans_deleted: int = 0
+    bytes_reclaimed: int = 0
+    last_report: RetentionReport = field(default_factory=RetentionReport)
+
+
+class RetentionService:
+    """
+    Applies a retention policy to the traces table in the background, once
+    at startup and then every `interval` seconds.
+
+    Each run happens in a worker thread; the deletes it issues are batched
+    (or drop whole partitions), so ingestion and the Traces tab keep working
+    while it runs.
+    """
+
+    def __init__(
+        self,
+        sql_engine: "OtelTracesSqlEngine",
+        policy: Optional[RetentionPolicy] = None,
+        interval: float = 60 * 60,
+    ):
+        self.sql_engine = sql_engine
+        self.policy = policy or RetentionPolicy()
+        self.interval = interval
+        self.stats = RetentionStats()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="trace-retention"
+        )
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops scheduling runs, waiting for the current one to finish."""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        # The current run may take a while: wait for it off the event loop
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Failed to apply the trace retention policy")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> RetentionReport:
+        policy = self.policy
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self._executor,
+                lambda: self.sql_engine.apply_retention(
+                    raw_days=policy.raw_days,
+                    keep_days=policy.keep_days,
+                    slow_threshold=policy.slow_threshold,
+                    minute_rollup_days=policy.minute_rollup_days,
+                    hourly_rollup_days=policy.hourly_rollup_days,
+                    batch_size=policy.batch_size,
+                    compact=policy.compact,
+                ),
+            )
+        except Exception:
+            self.stats.failed_runs += 1
+            raise
+        report = RetentionReport(**result, seconds=time.monotonic() - start)
+        self.stats.runs += 1
+        self.stats.spans_deleted += report.spans_deleted
+        self.stats.bytes_reclaimed += report.bytes_reclaimed
+        self.stats.last_report = report
+        logger.info(
+            "Retention deleted %d spans and %d partitions, reclaimed %d bytes in %.1fs",
+            report.spans_deleted,
+            report.partitions_dropped,
+            report.bytes_reclaimed,
+            report.seconds,
+        )
+        return report
@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Sequence
+
+from opentelemetry.context import Context
+from opentelemetry.sdk.trace import (
+    ReadableSpan,
+    Span,
+    SpanProcessor,
+    SynchronousMultiSpanProcessor,
+)
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.trace import StatusCode
+
+logger = logging.getLogger(__name__)
+
+# Decisions remembered for spans ending after their trace was decided
+DECISIONS_KEPT = 10000
+
+
+@dataclass
+class TailSamplingStats:
+    traces_kept: int = 0
+    traces_dropped: int = 0
+    # Why the traces were kept
+    kept_errors: int = 0
+    kept_slow: int = 0
+    kept_sampled: int = 0
+    spans_kept: int = 0
+    spans_dropped: int = 0
+    # Traces decided before they completed, after `decision_wait` or because
+    # the buffer was full
+    traces_timed_out: int = 0
+    traces_evicted: int = 0
+
+
+@dataclass
+class _BufferedTrace:
+    first_seen: float
+    spans: List[ReadableSpan] = field(default_factory=list)
+    open_spans: int = 0
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """
+    Span processor that buffers the spans of each trace until the trace is
+    complete (none of its spans is still open), then keeps or drops the
+    trace as a whole. Kept traces are passed to the processors added with
+    `add_span_processor`.
+
+    Traces with an error are always kept, and so are traces lasting longer
+    than the `latency_percentile` of the last `latency_window` traces (once
+    `min_traces` traces were seen). The others are kept with probability
+    `sample_rate`, decided on the trace id so that every process sampling
+    the same trace agrees.
+
+    A trace still incomplete `decision_wait` seconds after its first span is
+    decided anyway, and the oldest traces are decided early when more than
+    `max_spans` spans or `max_traces` traces are buffered.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.1,
+        latency_percentile: float = 99.0,
+        decision_wait: float = 30.0,
+        max_spans: int = 100000,
+        max_traces: int = 10000,
+        latency_window: int = 1000,
+        min_traces: int = 100,
+    ):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate must be between 0 and 1, not {sample_rate}")
+        self.sample_rate = sample_rate
+        self.latency_percentile = latency_percentile
+        self.decision_wait = decision_wait
+        self.max_spans = max_spans
+        self.max_traces = max_traces
+        self.min_traces = min_traces
+        self.stats = TailSamplingStats()
+        self._processors = SynchronousMultiSpanProcessor()
+        # In the order their first span was seen
+        self._traces: "OrderedDict[int, _BufferedTrace]" = OrderedDict()
+        self._buffered_spans = 0
+        self._decisions: "OrderedDict[int, bool]" = OrderedDict()
+        self._durations: Deque[int] = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="tail-sampling", daemon=True
+        )
+        self._worker.start()
+
+    def add_span_processor(self, span_processor: SpanProcessor) -> None:
+        """Adds a processor that the spans of the kept traces are passed to."""
+        self._processors.add_span_processor(span_processor)
+
+    def on_start(self, span: Span, parent_context: Optional[Context] = None) -> None:
+        trace_id = span.context.trace_id
+        with self._lock:
+            if trace_id in self._decisions:
+                return
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                trace = self._traces[trace_id] = _BufferedTrace(time.monotonic())
+            trace.open_spans += 1
+
+    def on_end(self, span: ReadableSpan) -> None:
+        trace_id = span.context.trace_id  # type: ignore[union-attr]
+        kept: List[ReadableSpan] = []
+        with self._lock:
+            decision = self._decisions.get(trace_id)
+            if decision is not None:
+                # A span ending after its trace was decided follows the decision
+                if decision:
+                    self.stats.spans_kept += 1
+                    kept.append(span)
+                else:
+                    self.stats.spans_dropped += 1
+            else:
+                trace = self._traces.get(trace_id)
+                if trace is None:
+                    # Started before this processor was registered
+                    trace = self._traces[trace_id] = _BufferedTrace(
+                        time.monotonic(), open_spans=1
+                    )
+                trace.spans.append(span)
+                trace.open_spans -= 1
+                self._buffered_spans += 1
+                if trace.open_spans <= 0:
+                    kept += self._decide(trace_id)
+                while self._traces and (
+                    self._buffered_spans > self.max_spans
+                    or len(self._traces) > self.max_traces
+                ):
+                    self.stats.traces_evicted += 1
+                    kept += self._decide(next(iter(self._traces)))
+        self._forward(kept)
+
+    def _forward(self, spans: List[ReadableSpan]) -> None:
+        for span in spans:
+            self._processors.on_end(span)
+
+    def _decide(self, trace_id: int) -> List[ReadableSpan]:
+        """Keeps or drops a buffered trace, returning the spans to pass on."""
+        trace = self._traces.pop(trace_id)
+        self._buffered_spans -= len(trace.spans)
+        keep = self._keep(trace_id, trace.spans)
+        self._decisions[trace_id] = keep
+        if len(self._decisions) > DECISIONS_KEPT:
+            self._decisions.popitem(last=False)
+        if keep:
+            self.stats.traces_kept += 1
+            self.stats.spans_kept += len(trace.spans)
+            return trace.spans
+        self.stats.traces_dropped += 1
+        self.stats.spans_dropped += len(trace.spans)
+        return []
+
+    def _keep(self, trace_id: int, spans: List[ReadableSpan]) -> bool:
+        if any(span.status.status_code is StatusCode.ERROR for span in spans):
+            self.stats.kept_errors += 1
+            return True
+        if spans:
+            duration = max(span.end_time or 0 for span in spans) - min(
+                span.start_time or 0 for span in spans
+            )
+            slow = len(self._durations) >= self.min_traces and duration > float(
+                np.percentile(self._durations, self.latency_percentile)
+            )
+            self._durations.append(duration)
+            if slow:
+                self.stats.kept_slow += 1
+                return True
+        # Same rule as the TraceIdRatioBased sampler, on the low 64 bits
+        if (trace_id & 0xFFFFFFFFFFFFFFFF) < self.sample_rate * 2**64:
+            self.stats.kept_sampled += 1
+            return True
+        return False
+
+    def _run(self) -> None:
+        while not self._done.wait(min(self.decision_wait / 2, 1.0)):
+            try:
+                self._decide_expired()
+            except Exception:
+                logger.exception("Failed to decide the expired traces")
+
+    def _decide_expired(self) -> None:
+        kept: List[ReadableSpan] = []
+        deadline = time.monotonic() - self.decision_wait
+        with self._lock:
+            while self._traces:
+                trace_id, trace = next(iter(self._traces.items()))
+                if trace.first_seen > deadline:
+                    break
+                self.stats.traces_timed_out += 1
+                kept += self._decide(trace_id)
+        self._forward(kept)
+
+    def _decide_all(self) -> None:
+        kept: List[ReadableSpan] = []
+        with self._lock:
+            while self._traces:
+                kept += self._decide(next(iter(self._traces)))
+        self._forward(kept)
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        """Decides every buffered trace, complete or not, and flushes the kept spans."""
+        self._decide_all()
+        return self._processors.force_flush(timeout_millis)
+
+    def shutdown(self) -> None:
+        self._done.set()
+        self._worker.join()
+        self._decide_all()
+        self._processors.shutdown()
+
+
+class NoOpSpanExporter(SpanExporter):
+    """
+    Exporter that drops every span. For instrumentations that always export
+    through an exporter of their own, while the spans are exported through a
+    `TailSamplingSpanProcessor` registered on the same tracer provider.
+    """
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        return SpanExportResult.SUCCESS
@@ -1,9 +1,22 @@
-from utils import answer_question_about_course, extract_syllabus
-from fastmcp import FastMCP
-from typing import Union, Literal
+import json
+import os
+
+from utils import answer_question_about_course, extract_syllabi, extract_syllabus
+from fastmcp import Context, FastMCP
+from typing import List, Optional, Union, Literal
+from llama_index.observability.otel import LlamaIndexOpenTelemetry
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+    OTLPSpanExporter,
+)
 
 mcp: FastMCP = FastMCP("Syllabus Extraction MCP")
 
+# Trace the tools too, e.g. to see which extractions were served from the cache
+instrumentor = LlamaIndexOpenTelemetry(
+    service_name_or_resource="agent.traces",
+    span_exporter=OTLPSpanExporter("http://0.0.0.0:4318/v1/traces"),
+)
+
 SYLLABUS_EXTRACTOR_TOOL_DESCRIPTION = """
 Tool to extract information from a syllabus PDF file.
 
@@ -14,11 +27,30 @@ Returns:
     str: the extracted information from the syllabus in JSON-like format, if any.
 """
 
+BATCH_SYLLABUS_EXTRACTOR_TOOL_DESCRIPTION = """
+Tool to extract information from many syllabus PDF files at once.
+
+Args:
+    paths (list[str]): Paths to syllabus files, or to directories containing them.
+
+Returns:
+    str: a JSON array with, for each distinct file, the file path and the extracted information (or the error).
+"""
+
+# Extractions running at once, and started per second, by the batch tool
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_EXTRACTION_CONCURRENCY", "4"))
+BATCH_RATE_LIMIT: Optional[float] = (
+    float(os.environ["BATCH_EXTRACTION_RATE_LIMIT"])
+    if os.getenv("BATCH_EXTRACTION_RATE_LIMIT")
+    else None
+)
+
 ANSWER_QUESTIONS_TOOL_DESCRIPTION = """
 Tool to answer question about a course syllabus.
 
 Args:
     question (str): The question about the syllabus.
+    file_paths (list[str], optional): Paths of the syllabus files the question is about, e.g. files that were just extracted: the answer waits for them to be indexed.
 
 Returns:
     str: The answer to the question, if any.
@@ -37,13 +69,33 @@ async def syllabus_extractor_tool(
     return extraction_info
 
 
+@mcp.tool(
+    name="batch_syllabus_extractor_tool",
+    description=BATCH_SYLLABUS_EXTRACTOR_TOOL_DESCRIPTION,
+)
+async def batch_syllabus_extractor_tool(paths: List[str], ctx: Context) -> str:
+    async def report_progress(done: int, total: int, file: str) -> None:
+        await ctx.report_progress(progress=done, total=total, message=file)
+
+    results = await extract_syllabi(
+        paths,
+        max_concurrency=BATCH_MAX_CONCURRENCY,
+        rate_limit=BATCH_RATE_LIMIT,
+        on_progress=report_progress,
+    )
+    return json.dumps(results, separators=(",", ":"))
+
+
 @mcp.tool(name="answer_questions_tool", description=ANSWER_QUESTIONS_TOOL_DESCRIPTION)
-async def answer_questions_tool(question: str):
-    response = await answer_question_about_course(question=question)
+async def answer_questions_tool(question: str, file_paths: Optional[List[str]] = None):
+    response = await answer_question_about_course(
+        question=question, file_paths=file_paths
+    )
     if not response:
         return "Sorry, no answer could be found for this question."
     return response
 
 
 if __name__ == "__main__":
+    instrumentor.start_registering()
     mcp.run("streamable-http")
@@ -1,19 +1,102 @@
+import asyncio
+import duckdb
+import functools
+import hashlib
+import io
+import itertools
+import logging
 import requests
 import time
-import csv
 import pandas as pd
-import tempfile as temp
+import numpy as np
 import os
 import json
+import math
+import re
+import shutil
+import threading
+import zlib
 
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
-from sqlalchemy import Engine, create_engine, Connection, Result
-from typing import Optional, Dict, Any, List, Literal, Union, cast
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timezone
+from opentelemetry.trace import get_tracer
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Connection,
+    Engine,
+    Index,
+    JSON,
+    MetaData,
+    Result,
+    Select,
+    Table,
+    Text,
+    column,
+    create_engine,
+    func,
+    inspect,
+    literal,
+    select,
+    text,
+    true,
+    tuple_,
+    type_coerce,
+)
+from sqlalchemy import table as sql_table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Dialect
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy.sql.expression import Executable
+from typing import (
+    Optional,
+    Dict,
+    Any,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 from llama_cloud_services import LlamaExtract
 from llama_cloud.client import AsyncLlamaCloud
 from llama_index.indices.managed.llama_cloud import LlamaCloudIndex
 from llama_index.llms.openai import OpenAI
 
+try:
+    from .extraction import (
+        BackgroundIndexer,
+        ExtractionCache,
+        SingleFlight,
+        extract_files,
+        file_sha256,
+    )
+except ImportError:
+    # Imported as a top-level module by the entry scripts
+    from extraction import (
+        BackgroundIndexer,
+        ExtractionCache,
+        SingleFlight,
+        extract_files,
+        file_sha256,
+    )
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 if (
     os.getenv("LLAMACLOUD_API_KEY", None)
@@ -31,6 +114,466 @@ if (
         api_key=os.getenv("LLAMACLOUD_API_KEY"), pipeline_id=PIPELINE_ID
     ).as_query_engine(llm=LLM)
 
+# Column layout of the traces table, with the dtype each column is built with
+TRACES_DTYPES: Dict[str, str] = {
+    "trace_id": "object",
+    "span_id": "object",
+    "parent_span_id": "object",
+    "operation_name": "category",
+    "start_time": "int64",
+    "duration": "int64",
+    "status_code": "category",
+    "service_name": "category",
+    "attributes": "object",
+    "events": "object",
+    "tool_name": "category",
+    "llm_model": "category",
+    "input_tokens": "Int64",
+    "output_tokens": "Int64",
+    "total_tokens": "Int64",
+}
+# Span attributes copied into typed, indexed columns (the first key a span
+# has wins), so that the Traces tab can filter and sort on them cheaply
+PROMOTED_ATTRIBUTES: Dict[str, List[str]] = {
+    "tool_name": ["gen_ai.tool.name", "tool.name"],
+    "llm_model": ["gen_ai.response.model", "gen_ai.request.model", "llm.model_name"],
+    "input_tokens": [
+        "gen_ai.usage.input_tokens",
+        "gen_ai.usage.prompt_tokens",
+        "llm.token_count.prompt",
+    ],
+    "output_tokens": [
+        "gen_ai.usage.output_tokens",
+        "gen_ai.usage.completion_tokens",
+        "llm.token_count.completion",
+    ],
+    "total_tokens": ["gen_ai.usage.total_tokens", "llm.token_count.total"],
+}
+PROMOTED_KEYS = {key for keys in PROMOTED_ATTRIBUTES.values() for key in keys}
+# Stored as JSONB on Postgres and as JSON text on SQLite
+JSON_COLUMNS = ["attributes", "events"]
+SpanJSON = JSON(none_as_null=True).with_variant(
+    postgresql.JSONB(none_as_null=True), "postgresql"
+)
+
+
+# Most bound parameters in one statement (SQLite 3.32+ and Postgres allow 32766)
+MAX_BOUND_PARAMETERS = 32766
+
+
+def _placeholder(paramstyle: str) -> Callable[[int], str]:
+    """Positional placeholder of the n-th parameter (from 1) in a paramstyle."""
+    if paramstyle == "qmark":
+        return lambda n: "?"
+    if paramstyle in ("format", "pyformat"):
+        return lambda n: "%s"
+    if paramstyle == "numeric":
+        return lambda n: f":{n}"
+    if paramstyle == "numeric_dollar":
+        return lambda n: f"${n}"
+    raise NotImplementedError(f"Unsupported paramstyle: {paramstyle}")
+
+
+def _json_cast(dialect_name: str, placeholder: str) -> str:
+    return (
+        f"CAST({placeholder} AS JSONB)" if dialect_name == "postgresql" else placeholder
+    )
+
+
+def _column_values(series: pd.Series) -> List[Any]:
+    """The values of a column as Python objects, with None for missing ones."""
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+def _dialect_insert(dialect_name: str, table: Table) -> Any:
+    if dialect_name == "postgresql":
+        return postgresql.insert(table)
+    if dialect_name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upserts are not supported for {dialect_name} databases")
+
+
+# Metadata key of the counter bumped by every write to the traces table
+INGESTION_GENERATION_KEY = "ingestion_generation"
+# Spans that started before this time were moved to the Parquet archive
+ARCHIVED_UNTIL_KEY = "archived_until"
+# Spans that started before this time were pruned down to error and slow traces
+PRUNED_UNTIL_KEY = "retention_pruned_until"
+DAY = 24 * 60 * 60 * 1000000
+
+
+def _sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+# json.dumps builds an encoder per call when given separators
+_JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def _json_text(value: Any) -> Optional[str]:
+    if isinstance(value, (dict, list)):
+        return _JSON_ENCODER.encode(value)
+    return None
+
+
+def _with_json_text(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """The dataframe, with its JSON columns serialized (for COPY and Parquet)."""
+    return dataframe.assign(
+        **{
+            name: dataframe[name].map(_json_text)
+            for name in JSON_COLUMNS
+            if name in dataframe
+        }
+    )
+
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    Thread-safe least-recently-used cache holding at most `maxsize` entries.
+
+    With a `ttl` (in seconds), entries older than that are treated as missing.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                self.ttl is None or time.monotonic() - entry[0] < self.ttl
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DDSketch:
+    """
+    Mergeable quantile sketch (DDSketch) over non-negative values.
+
+    Values are counted in logarithmic bins, so any quantile is returned within
+    `relative_accuracy` of the true value, and two sketches merge by adding
+    their bins. It serializes to JSON for storage in the rollup tables.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values: Union[np.ndarray, List[float]]) -> "DDSketch":
+        values = np.asarray(values, dtype="float64")
+        positive = values[values > 0]
+        self.zero_count += int(len(values) - len(positive))
+        indexes, counts = np.unique(
+            np.ceil(np.log(positive) / self._log_gamma).astype("int64"),
+            return_counts=True,
+        )
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += int(len(values))
+        return self
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma**index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "relative_accuracy": self.relative_accuracy,
+                "zero_count": self.zero_count,
+                "bins": self.bins,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "DDSketch":
+        payload = json.loads(data)
+        sketch = cls(relative_accuracy=payload["relative_accuracy"])
+        sketch.zero_count = payload["zero_count"]
+        sketch.bins = {int(index): count for index, count in payload["bins"].items()}
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        return sketch
+
+
+# Width of the latency rollup buckets, in microseconds
+ROLLUP_GRANULARITIES: Dict[str, int] = {
+    "1m": 60 * 1000000,
+    "1h": 60 * 60 * 1000000,
+}
+ROLLUP_KEYS = ["bucket_start", "service_name", "operation_name", "status_code"]
+# What the rollups need of each span
+ROLLUP_SPAN_COLUMNS = [
+    "service_name",
+    "operation_name",
+    "status_code",
+    "start_time",
+    "duration",
+]
+
+
+class TracesSchema:
+    """
+    Declares the traces table, its indexes, the sync metadata table and the
+    per-minute and per-hour latency rollup tables.
+
+    `ensure` creates whatever is missing and migrates traces tables created
+    before the primary key (or the attribute columns) existed; with `partition_by_day`, the Postgres
+    table is range-partitioned on `start_time`, one partition per UTC day.
+    """
+
+    def __init__(self, table_name: str, partition_by_day: bool = False):
+        self.table_name = table_name
+        self.partition_by_day = partition_by_day
+        self.metadata = MetaData()
+        partitioning: Dict[str, Any] = (
+            {"postgresql_partition_by": "RANGE (start_time)"}
+            if partition_by_day
+            else {}
+        )
+        self.traces = Table(
+            table_name,
+            self.metadata,
+            Column("trace_id", Text, primary_key=True),
+            Column("span_id", Text, primary_key=True),
+            Column("parent_span_id", Text, nullable=True),
+            Column("operation_name", Text, nullable=False),
+            # A partitioned table's primary key has to include the partition key
+            Column(
+                "start_time", BigInteger, nullable=False, primary_key=partition_by_day
+            ),
+            Column("duration", BigInteger, nullable=False),
+            Column("status_code", Text, nullable=False),
+            Column("service_name", Text, nullable=False),
+            # Every tag of the span, and its logs (the span events)
+            Column("attributes", SpanJSON, nullable=True),
+            Column("events", SpanJSON, nullable=True),
+            *(
+                Column(name, Text if dtype == "category" else BigInteger)
+                for name, dtype in TRACES_DTYPES.items()
+                if name in PROMOTED_ATTRIBUTES
+            ),
+            # trace_id lookups are already served by the primary key
+            Index(f"ix_{table_name}_parent_span_id", "parent_span_id"),
+            # Serves time-range filters and keyset pagination on (start_time, span_id)
+            Index(f"ix_{table_name}_start_time_span_id", "start_time", "span_id"),
+            # Serves containment (@>) filters on the attributes
+            Index(
+                f"ix_{table_name}_attributes",
+                "attributes",
+                postgresql_using="gin",
+                postgresql_ops={"attributes": "jsonb_path_ops"},
+            ).ddl_if(dialect="postgresql"),
+            # The slowest calls of a tool, or to a model
+            Index(f"ix_{table_name}_tool_name_duration", "tool_name", "duration"),
+            Index(f"ix_{table_name}_llm_model_duration", "llm_model", "duration"),
+            Index(f"ix_{table_name}_total_tokens", "total_tokens"),
+            **partitioning,
+        )
+        self.sync_metadata = Table(
+            f"{table_name}_metadata",
+            self.metadata,
+            Column("key", Text, primary_key=True),
+            Column("value", BigInteger, nullable=False),
+        )
+        # Span count, total duration and a DDSketch of the durations per bucket
+        self.rollups: Dict[str, Table] = {
+            granularity: Table(
+                f"{table_name}_rollup_{granularity}",
+                self.metadata,
+                Column("bucket_start", BigInteger, primary_key=True),
+                Column("service_name", Text, primary_key=True),
+                Column("operation_name", Text, primary_key=True),
+                Column("status_code", Text, primary_key=True),
+                Column("span_count", BigInteger, nullable=False),
+                Column("duration_sum", BigInteger, nullable=False),
+                Column("sketch", Text, nullable=False),
+            )
+            for granularity in ROLLUP_GRANULARITIES
+        }
+        self._partitions: Set[int] = set()
+
+    def reset(self) -> None:
+        self._partitions.clear()
+
+    def ensure(self, connection: Connection) -> None:
+        inspector = inspect(connection)
+        if inspector.has_table(self.table_name):
+            if self.partition_by_day and not self._is_partitioned(connection):
+                raise ValueError(
+                    f"Table '{self.table_name}' exists and is not partitioned"
+                )
+            if not inspector.get_pk_constraint(self.table_name)["constrained_columns"]:
+                self._migrate_legacy(connection)
+            else:
+                self._add_missing_columns(connection)
+                self._drop_superseded_indexes(connection)
+        self.metadata.create_all(connection, checkfirst=True)
+        for index in self.traces.indexes:
+            index.create(connection, checkfirst=True)
+
+    def ensure_partitions(
+        self, connection: Connection, day_starts: Iterable[int]
+    ) -> None:
+        """Creates the partitions of the days starting at `day_starts`."""
+        preparer = connection.dialect.identifier_preparer
+        for day_start in sorted(set(day_starts)):
+            if day_start in self._partitions:
+                continue
+            date = datetime.fromtimestamp(day_start / 1000000, tz=timezone.utc)
+            partition = f"{self.table_name}_p{date:%Y%m%d}"
+            connection.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {preparer.quote(partition)} "
+                    f"PARTITION OF {preparer.quote(self.table_name)} "
+                    f"FOR VALUES FROM ({day_start}) TO ({day_start + DAY})"
+                )
+            )
+            self._partitions.add(day_start)
+
+    def drop_partition(self, connection: Connection, day_start: int) -> None:
+        preparer = connection.dialect.identifier_preparer
+        date = datetime.fromtimestamp(day_start / 1000000, tz=timezone.utc)
+        partition = f"{self.table_name}_p{date:%Y%m%d}"
+        connection.execute(text(f"DROP TABLE IF EXISTS {preparer.quote(partition)}"))
+        self._partitions.discard(day_start)
+
+    def partition_days(self, connection: Connection) -> List[int]:
+        """Start of the day of every existing partition."""
+        names = connection.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(:name)"
+            ),
+            {"name": self.table_name},
+        ).scalars()
+        days = []
+        for name in names:
+            date = datetime.strptime(name.rsplit("_p", 1)[1], "%Y%m%d")
+            days.append(int(date.replace(tzinfo=timezone.utc).timestamp()) * 1000000)
+        return sorted(days)
+
+    def _is_partitioned(self, connection: Connection) -> bool:
+        if connection.dialect.name != "postgresql":
+            return False
+        relkind = connection.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+            {"name": self.table_name},
+        ).scalar_one_or_none()
+        return relkind == "p"
+
+    def _add_missing_columns(self, connection: Connection) -> None:
+        # Columns added since the table was created are all nullable, so adding
+        # them doesn't rewrite the table
+        existing = {c["name"] for c in inspect(connection).get_columns(self.table_name)}
+        preparer = connection.dialect.identifier_preparer
+        for missing in self.traces.columns:
+            if missing.name in existing:
+                continue
+            connection.execute(
+                text(
+                    f"ALTER TABLE {preparer.quote(self.table_name)} "
+                    f"ADD COLUMN {preparer.quote(missing.name)} "
+                    f"{missing.type.compile(dialect=connection.dialect)}"
+                )
+            )
+
+    def _drop_superseded_indexes(self, connection: Connection) -> None:
+        # The start_time index of the first keyed tables is superseded by the
+        # (start_time, span_id) index; legacy tables lose all their indexes
+        superseded = f"ix_{self.table_name}_start_time"
+        indexes = inspect(connection).get_indexes(self.table_name)
+        if any(index["name"] == superseded for index in indexes):
+            preparer = connection.dialect.identifier_preparer
+            connection.execute(text(f"DROP INDEX {preparer.quote(superseded)}"))
+
+    def _migrate_legacy(self, connection: Connection) -> None:
+        # Tables created by pandas or the old CREATE TABLE have no primary key
+        # (and possibly duplicate spans): copy the distinct spans into a new table
+        preparer = connection.dialect.identifier_preparer
+        legacy_name = f"{self.table_name}_legacy"
+        connection.execute(
+            text(
+                f"ALTER TABLE {preparer.quote(self.table_name)} "
+                f"RENAME TO {preparer.quote(legacy_name)}"
+            )
+        )
+        for index in inspect(connection).get_indexes(legacy_name):
+            if index["name"] is not None:
+                connection.execute(text(f"DROP INDEX {preparer.quote(index['name'])}"))
+        legacy_columns = {
+            c["name"] for c in inspect(connection).get_columns(legacy_name)
+        }
+        self.traces.create(connection)
+        names = [c.name for c in self.traces.columns if c.name in legacy_columns]
+        legacy = sql_table(legacy_name, *(column(name) for name in names))
+        if self.partition_by_day:
+            day_start = legacy.c.start_time - legacy.c.start_time % DAY
+            days = connection.execute(select(day_start).distinct()).scalars()
+            self.ensure_partitions(connection, (int(day) for day in days))
+        statement = _dialect_insert(connection.dialect.name, self.traces)
+        # SQLite needs a WHERE clause to parse INSERT ... SELECT ... ON CONFLICT
+        connection.execute(
+            statement.from_select(
+                names, select(legacy).where(true())
+            ).on_conflict_do_nothing()
+        )
+        connection.execute(text(f"DROP TABLE {preparer.quote(legacy_name)}"))
+
 
 class OtelTracesSqlEngine:
     def __init__(
@@ -39,19 +582,131 @@ class OtelTracesSqlEngine:
         engine_url: Optional[Dict[str, Any]] = None,
         table_name: Optional[str] = None,
         service_name: Optional[str] = None,
+        chunksize: Optional[int] = None,
+        jaeger_url: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        partition_by_day: bool = False,
+        async_engine_url: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        max_overflow: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+        pool_recycle: Optional[int] = None,
+        pool_pre_ping: bool = True,
+        query_cache_size: int = 128,
+        archive_dir: Optional[str] = None,
     ):
         self.service_name: str = service_name or "service"
         self.table_name: str = table_name or "otel_traces"
-        self._connection: Optional[Connection] = None
+        self.chunksize: int = chunksize or 10000
+        self.jaeger_url: str = jaeger_url or "http://localhost:16686/api/traces"
+        self.max_workers: int = max_workers or 4
+        # Where closed days of spans are archived as Parquet, see `archive_partitions`
+        self.archive_dir: Optional[str] = archive_dir
+        self._session = self._create_session()
+        pool_options: Dict[str, Any] = {
+            name: value
+            for name, value in (
+                ("pool_size", pool_size),
+                ("max_overflow", max_overflow),
+                ("pool_timeout", pool_timeout),
+                ("pool_recycle", pool_recycle),
+            )
+            if value is not None
+        }
         if engine:
             self._engine: Engine = engine
         elif engine_url:
-            self._engine = create_engine(url=engine_url)
+            self._engine = create_engine(
+                url=engine_url, pool_pre_ping=pool_pre_ping, **pool_options
+            )
         else:
             raise ValueError("One of engine or engine_setup_kwargs must be set")
+        self._async_engine: Optional[AsyncEngine] = None
+        if async_engine_url:
+            self._async_engine = create_async_engine(
+                url=async_engine_url, pool_pre_ping=pool_pre_ping, **pool_options
+            )
+        if partition_by_day and self._engine.dialect.name != "postgresql":
+            raise ValueError("Partitioning by day is only supported on Postgres")
+        self.schema = TracesSchema(
+            table_name=self.table_name, partition_by_day=partition_by_day
+        )
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        # DataFrames returned by `execute(return_pandas=True)`, keyed by the
+        # ingestion generation they were read at
+        self._query_cache: LRUCache[pd.DataFrame] = LRUCache(maxsize=query_cache_size)
+
+    @property
+    def has_async_engine(self) -> bool:
+        return self._async_engine is not None
+
+    def connect(self) -> Connection:
+        """Checks a connection out of the pool, to be used as a context manager."""
+        return self._engine.connect()
+
+    def begin(self) -> ContextManager[Connection]:
+        """Checks a connection out of the pool inside a transaction."""
+        return self._engine.begin()
+
+    def ensure_schema(self) -> None:
+        with self._schema_lock:
+            with self.begin() as connection:
+                inspector = inspect(connection)
+                # Spans stored before the rollups existed have to be rolled up once
+                backfill = inspector.has_table(self.table_name) and not all(
+                    inspector.has_table(rollup.name)
+                    for rollup in self.schema.rollups.values()
+                )
+                self.schema.ensure(connection)
+            self._schema_ready = True
+        if backfill:
+            self.rebuild_rollups()
+
+    def _get_metadata(self, connection: Connection, key: str) -> Optional[int]:
+        metadata = self.schema.sync_metadata
+        return connection.execute(
+            select(metadata.c.value).where(metadata.c.key == key)
+        ).scalar_one_or_none()
+
+    def _set_metadata(self, connection: Connection, key: str, value: int) -> None:
+        metadata = self.schema.sync_metadata
+        statement = _dialect_insert(connection.dialect.name, metadata).values(
+            key=key, value=value
+        )
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[metadata.c.key], set_={"value": value}
+            )
+        )
+
+    def _bump_generation(self, connection: Connection) -> None:
+        metadata = self.schema.sync_metadata
+        statement = _dialect_insert(connection.dialect.name, metadata).values(
+            key=INGESTION_GENERATION_KEY, value=1
+        )
+        connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[metadata.c.key], set_={"value": metadata.c.value + 1}
+            )
+        )
+        # Entries read at older generations can never be hit again
+        self._query_cache.clear()
 
-    def _connect(self) -> None:
-        self._connection = self._engine.connect()
+    def get_generation(self) -> int:
+        """Counter that goes up every time spans are written to the traces table."""
+        if not self._schema_ready:
+            self.ensure_schema()
+        with self.connect() as connection:
+            return self._get_metadata(connection, key=INGESTION_GENERATION_KEY) or 0
+
+    def get_high_water_mark(self) -> Optional[int]:
+        if not self._schema_ready:
+            self.ensure_schema()
+        with self.connect() as connection:
+            return self._get_metadata(
+                connection, key=f"high_water_mark:{self.service_name}"
+            )
 
     def _export(
         self,
@@ -59,21 +714,78 @@ class OtelTracesSqlEngine:
         end_time: Optional[int] = None,
         limit: Optional[int] = None,
     ) -> Dict[str, Any]:
-        url = "http://localhost:16686/api/traces"
+        end_time = end_time or int(time.time() * 1000000)
+        start_time = start_time or end_time - (24 * 60 * 60 * 1000000)
+        limit = limit or 1000
+        traces: Dict[str, Dict[str, Any]] = {}
+        step = max((end_time - start_time) // self.max_workers, 1)
+        windows = [
+            (window_start, min(window_start + step, end_time))
+            for window_start in range(start_time, end_time, step)
+        ] or [(start_time, end_time)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {
+                pool.submit(self._fetch_traces, window, limit): window
+                for window in windows
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window_start, window_end = pending.pop(future)
+                    batch = future.result()
+                    if len(batch) >= limit and window_end - window_start > 1:
+                        # The window was truncated: fetch both halves instead
+                        middle = (window_start + window_end) // 2
+                        for window in ((window_start, middle), (middle, window_end)):
+                            pending[pool.submit(self._fetch_traces, window, limit)] = (
+                                window
+                            )
+                        continue
+                    for trace in batch:
+                        self._merge_trace(traces, trace)
+        return {"data": list(traces.values())}
+
+    def _create_session(self) -> requests.Session:
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=["GET"],
+        )
+        adapter = HTTPAdapter(pool_maxsize=self.max_workers, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _fetch_traces(
+        self, window: Tuple[int, int], limit: int
+    ) -> List[Dict[str, Any]]:
         params = {
             "service": self.service_name,
-            "start": start_time
-            or int(time.time() * 1000000) - (24 * 60 * 60 * 1000000),
-            "end": end_time or int(time.time() * 1000000),
-            "limit": limit or 1000,
+            "start": window[0],
+            "end": window[1],
+            "limit": limit,
         }
-        response = requests.get(url, params=params)
-        print(response.json())
-        return response.json()
+        response = self._session.get(self.jaeger_url, params=params, timeout=30)
+        response.raise_for_status()
+        return response.json().get("data") or []
+
+    @staticmethod
+    def _merge_trace(traces: Dict[str, Dict[str, Any]], trace: Dict[str, Any]) -> None:
+        # Traces crossing a window boundary are returned by both windows
+        existing = traces.setdefault(trace["traceID"], trace)
+        if existing is trace:
+            return
+        seen = {span["spanID"] for span in existing["spans"]}
+        existing["spans"].extend(
+            span for span in trace["spans"] if span["spanID"] not in seen
+        )
+        existing.setdefault("processes", {}).update(trace.get("processes", {}))
 
     def _to_pandas(self, data: Dict[str, Any]) -> pd.DataFrame:
-        rows: List[Dict[str, Any]] = []
-        # Loop over each trace
+        columns: Dict[str, List[Any]] = {name: [] for name in TRACES_DTYPES}
+        # Loop over each trace, filling one array per column
         for trace in data.get("data", []):
             trace_id = trace.get("traceID")
             service_map = {
@@ -82,127 +794,1444 @@ class OtelTracesSqlEngine:
             }
 
             for span in trace.get("spans", []):
-                span_id = span.get("spanID")
-                operation = span.get("operationName")
-                start = span.get("startTime")
-                duration = span.get("duration")
-                process_id = span.get("processID")
-                service = service_map.get(process_id, "")
-                status = next(
-                    (
-                        tag.get("value")
-                        for tag in span.get("tags", [])
-                        if tag.get("key") == "otel.status_code"
-                    ),
-                    "",
-                )
-                parent_span_id = None
-                if span.get("references"):
-                    parent_span_id = span["references"][0].get("spanID")
-
-                rows.append(
+                attributes = {
+                    tag.get("key"): tag.get("value") for tag in span.get("tags") or []
+                }
+                events = [
                     {
-                        "trace_id": trace_id,
-                        "span_id": span_id,
-                        "parent_span_id": parent_span_id,
-                        "operation_name": operation,
-                        "start_time": start,
-                        "duration": duration,
-                        "status_code": status,
-                        "service_name": service,
+                        "timestamp": log.get("timestamp"),
+                        "fields": {
+                            field.get("key"): field.get("value")
+                            for field in log.get("fields") or []
+                        },
                     }
-                )
+                    for log in span.get("logs") or []
+                ]
+                parent_span_id = None
+                references = span.get("references") or []
+                # FOLLOWS_FROM links don't make the span a child, prefer CHILD_OF
+                for reference in references:
+                    if reference.get("refType") == "CHILD_OF":
+                        parent_span_id = reference.get("spanID")
+                        break
+                else:
+                    if references:
+                        parent_span_id = references[0].get("spanID")
 
-        # Define the CSV header
-        fieldnames = [
-            "trace_id",
-            "span_id",
-            "parent_span_id",
-            "operation_name",
-            "start_time",
-            "duration",
-            "status_code",
-            "service_name",
-        ]
+                columns["trace_id"].append(trace_id)
+                columns["span_id"].append(span.get("spanID"))
+                columns["parent_span_id"].append(parent_span_id)
+                columns["operation_name"].append(span.get("operationName"))
+                columns["start_time"].append(span.get("startTime"))
+                columns["duration"].append(span.get("duration"))
+                columns["status_code"].append(attributes.get("otel.status_code", ""))
+                columns["service_name"].append(
+                    service_map.get(span.get("processID"), "")
+                )
+                columns["attributes"].append(attributes)
+                columns["events"].append(events)
 
-        fl = temp.NamedTemporaryFile(suffix=".csv", delete=False, delete_on_close=False)
-        # Write to CSV
-        with open(fl.name, "w", newline="") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
+        for name in PROMOTED_ATTRIBUTES:
+            columns[name] = [None] * len(columns["attributes"])
+        for index, attributes in enumerate(columns["attributes"]):
+            # Most spans have none of the promoted attributes
+            if PROMOTED_KEYS.isdisjoint(attributes):
+                continue
+            for name, keys in PROMOTED_ATTRIBUTES.items():
+                columns[name][index] = next(
+                    (attributes[key] for key in keys if key in attributes), None
+                )
 
-        df = pd.read_csv(fl)
-        os.remove(fl.name)
-        return df
+        dataframe = pd.DataFrame(
+            {
+                name: (
+                    # Tag values may be strings, or missing on most spans
+                    pd.to_numeric(pd.Series(values, dtype="object"), errors="coerce")
+                    .round()
+                    .astype("Int64")
+                    if TRACES_DTYPES[name] == "Int64"
+                    else pd.Series(values, dtype=TRACES_DTYPES[name])
+                )
+                for name, values in columns.items()
+            }
+        )
+        dataframe["total_tokens"] = dataframe["total_tokens"].fillna(
+            dataframe["input_tokens"] + dataframe["output_tokens"]
+        )
+        return dataframe
 
     def _to_sql(
         self,
         dataframe: pd.DataFrame,
         if_exists_policy: Optional[Literal["fail", "replace", "append"]] = None,
+        chunksize: Optional[int] = None,
+    ) -> None:
+        with self.begin() as connection:
+            if inspect(connection).has_table(self.table_name):
+                if if_exists_policy == "fail":
+                    raise ValueError(f"Table '{self.table_name}' already exists.")
+                if if_exists_policy == "replace":
+                    generation = 0
+                    if inspect(connection).has_table(self.schema.sync_metadata.name):
+                        generation = (
+                            self._get_metadata(connection, INGESTION_GENERATION_KEY)
+                            or 0
+                        )
+                    self.schema.traces.drop(connection)
+                    self.schema.sync_metadata.drop(connection, checkfirst=True)
+                    for rollup in self.schema.rollups.values():
+                        rollup.drop(connection, checkfirst=True)
+                    self.schema.reset()
+                    self.schema.ensure(connection)
+                    # Keep counting from the old generation, so results cached
+                    # before the table was replaced can't be served again
+                    self._set_metadata(connection, INGESTION_GENERATION_KEY, generation)
+                    self._bump_generation(connection)
+        self._upsert(dataframe=dataframe, chunksize=chunksize)
+
+    def _copy_chunk(
+        self, connection: Connection, chunk: pd.DataFrame, table_name: str
     ) -> None:
-        if not self._connection:
-            self._connect()
-        dataframe.to_sql(
-            name=self.table_name,
-            con=self._connection,
-            if_exists=if_exists_policy or "append",
+        buffer = io.StringIO()
+        _with_json_text(chunk).to_csv(buffer, index=False, header=False, na_rep="\\N")
+        preparer = connection.dialect.identifier_preparer
+        columns = ", ".join(preparer.quote(name) for name in chunk.columns)
+        statement = (
+            f"COPY {preparer.quote(table_name)} ({columns}) "
+            "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        )
+        dbapi_connection = connection.connection.dbapi_connection
+        if dbapi_connection is None:
+            raise RuntimeError("The connection was invalidated before COPY")
+        cursor = dbapi_connection.cursor()
+        try:
+            if connection.dialect.driver == "psycopg2":
+                buffer.seek(0)
+                cursor.copy_expert(statement, buffer)
+            else:
+                with cursor.copy(statement) as copy:
+                    copy.write(buffer.getvalue())
+        finally:
+            cursor.close()
+
+    def _batches(
+        self, dataframe: pd.DataFrame, chunksize: Optional[int] = None
+    ) -> Iterator[pd.DataFrame]:
+        # A key may only be touched once per INSERT ... ON CONFLICT statement
+        dataframe = dataframe.drop_duplicates(
+            subset=["trace_id", "span_id"], keep="last"
+        )
+        chunksize = chunksize or self.chunksize
+        for start in range(0, len(dataframe), chunksize):
+            yield dataframe.iloc[start : start + chunksize]
+
+    def _ensure_partitions(self, chunk: pd.DataFrame) -> None:
+        # Created in their own short transaction, one writer at a time
+        with self._schema_lock, self.begin() as connection:
+            # Only the days with spans, not every day between the first and last
+            start_times = chunk["start_time"].to_numpy(dtype="int64")
+            self.schema.ensure_partitions(
+                connection, np.unique(start_times - start_times % DAY).tolist()
+            )
+
+    def _insert_statements(
+        self, dialect: Dialect, chunk: pd.DataFrame, update: bool
+    ) -> List[Tuple[str, Tuple[Any, ...]]]:
+        """
+        Multi-row INSERT statements writing the rows, with their parameters.
+        They return the keys of the rows inserted (with `update`, conflicting
+        rows are updated, otherwise they are left alone and not returned).
+        RETURNING needs SQLite 3.35 or later.
+        """
+        table = self.schema.traces
+        names = [name for name in chunk.columns if name in table.c]
+        placeholder = _placeholder(dialect.paramstyle)
+        preparer = dialect.identifier_preparer
+        key = ", ".join(preparer.quote(c.name) for c in table.primary_key.columns)
+        conflict = f"ON CONFLICT ({key}) "
+        if update:
+            conflict += "DO UPDATE SET " + ", ".join(
+                f"{preparer.quote(name)} = excluded.{preparer.quote(name)}"
+                for name in names
+                if not table.c[name].primary_key
+            )
+        else:
+            conflict += "DO NOTHING"
+        # Serialized here, as the values are bound without the column types
+        chunk = _with_json_text(chunk[names])
+        values = [_column_values(chunk[name]) for name in names]
+        rows = list(zip(*values))
+        per_statement = MAX_BOUND_PARAMETERS // len(names)
+        statements: List[Tuple[str, Tuple[Any, ...]]] = []
+
+        def row_sql(offset: int) -> str:
+            return (
+                "("
+                + ", ".join(
+                    _json_cast(dialect.name, placeholder(offset + position))
+                    if name in JSON_COLUMNS
+                    else placeholder(offset + position)
+                    for position, name in enumerate(names, start=1)
+                )
+                + ")"
+            )
+
+        for start in range(0, len(rows), per_statement):
+            batch = rows[start : start + per_statement]
+            if dialect.paramstyle in ("qmark", "format", "pyformat"):
+                tuples = ", ".join([row_sql(0)] * len(batch))
+            else:
+                tuples = ", ".join(
+                    row_sql(index * len(names)) for index in range(len(batch))
+                )
+            statements.append(
+                (
+                    f"INSERT INTO {preparer.quote(self.table_name)} "
+                    f"({', '.join(preparer.quote(name) for name in names)}) "
+                    f"VALUES {tuples} {conflict} RETURNING trace_id, span_id",
+                    tuple(itertools.chain.from_iterable(batch)),
+                )
+            )
+        return statements
+
+    def _execute_inserts(
+        self, connection: Connection, statements: List[Tuple[str, Tuple[Any, ...]]]
+    ) -> List[Tuple[str, str]]:
+        inserted: List[Tuple[str, str]] = []
+        for statement, parameters in statements:
+            result = connection.exec_driver_sql(statement, parameters)
+            inserted.extend(tuple(row) for row in result)
+        return inserted
+
+    def _split_inserted(
+        self, chunk: pd.DataFrame, inserted: List[Tuple[str, str]]
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """The rollup columns of the spans inserted, and the other spans."""
+        keys = set(inserted)
+        is_new = np.fromiter(
+            (key in keys for key in zip(chunk["trace_id"], chunk["span_id"])),
+            dtype=bool,
+            count=len(chunk),
+        )
+        return chunk.loc[is_new, ROLLUP_SPAN_COLUMNS], chunk[~is_new]
+
+    def _upsert_chunk(self, connection: Connection, chunk: pd.DataFrame) -> None:
+        table = self.schema.traces
+        primary_key = list(table.primary_key.columns)
+        updates = [c.name for c in table.columns if not c.primary_key]
+        dialect = connection.dialect
+        if dialect.driver in ("psycopg2", "psycopg") and not dialect.is_async:
+            # COPY the batch into a staging table, then merge it in one statement
+            staging = Table(
+                f"{self.table_name}_staging",
+                MetaData(),
+                *(Column(c.name, c.type) for c in table.columns),
+                prefixes=["TEMPORARY"],
+                postgresql_on_commit="DROP",
+            )
+            staging.create(connection)
+            self._copy_chunk(connection, chunk, table_name=staging.name)
+            # Insert the new spans, returning exactly those even under concurrent
+            # writers, then update the known spans whose values actually changed
+            result = connection.execute(
+                _dialect_insert(dialect.name, table)
+                .from_select([c.name for c in table.columns], select(staging))
+                .on_conflict_do_nothing(index_elements=primary_key)
+                .returning(*(table.c[name] for name in ROLLUP_SPAN_COLUMNS))
+            )
+            inserted = pd.DataFrame(result.all(), columns=[*result.keys()])
+            if len(inserted) < len(chunk):
+                connection.execute(
+                    table.update()
+                    .where(*(key == staging.c[key.name] for key in primary_key))
+                    .where(
+                        tuple_(*(table.c[name] for name in updates)).is_distinct_from(
+                            tuple_(*(staging.c[name] for name in updates))
+                        )
+                    )
+                    .values({name: staging.c[name] for name in updates})
+                )
+        else:
+            # The write itself tells which spans are new: only the others are
+            # written again, to update them
+            new_keys = self._execute_inserts(
+                connection, self._insert_statements(dialect, chunk, update=False)
+            )
+            inserted, known = self._split_inserted(chunk, new_keys)
+            if not known.empty:
+                self._execute_inserts(
+                    connection, self._insert_statements(dialect, known, update=True)
+                )
+        self._write_rollups(connection, self._rollup_rows(inserted))
+
+    def _rollup_rows(
+        self, spans: pd.DataFrame
+    ) -> Dict[str, Dict[Tuple[Any, ...], Dict[str, Any]]]:
+        """The rollup rows of newly inserted spans, per granularity."""
+        rollups: Dict[str, Dict[Tuple[Any, ...], Dict[str, Any]]] = {}
+        if spans.empty:
+            return rollups
+        spans = spans.astype(
+            {"start_time": "int64", "duration": "int64", "status_code": "object"}
+        )
+        for granularity, width in ROLLUP_GRANULARITIES.items():
+            buckets = spans.assign(
+                bucket_start=spans["start_time"] - spans["start_time"] % width
+            )
+            rows = rollups[granularity] = {}
+            durations = buckets["duration"].to_numpy()
+            # Positions of each group's spans, without building a frame per group
+            groups = buckets.groupby(ROLLUP_KEYS, observed=True, sort=False).indices
+            for key, positions in groups.items():
+                group = durations[positions]
+                rows[(int(key[0]), *key[1:])] = {
+                    "span_count": len(group),
+                    "duration_sum": int(group.sum()),
+                    "sketch": DDSketch().add(group),
+                }
+        return rollups
+
+    def _write_rollups(
+        self,
+        connection: Connection,
+        rollups: Dict[str, Dict[Tuple[Any, ...], Dict[str, Any]]],
+    ) -> None:
+        """Merges rollup rows into the rollup tables."""
+        if not rollups:
+            return
+        if connection.dialect.name == "postgresql":
+            # Sketches are merged in Python: one rollup writer at a time
+            connection.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"),
+                {"key": zlib.crc32(self.table_name.encode())},
+            )
+        for granularity, rows in rollups.items():
+            rollup = self.schema.rollups[granularity]
+            existing = connection.execute(
+                select(rollup)
+                .where(rollup.c.bucket_start.in_({key[0] for key in rows}))
+                .with_for_update()
+            )
+            for row in existing.mappings():
+                key = tuple(row[name] for name in ROLLUP_KEYS)
+                if key in rows:
+                    rows[key]["span_count"] += row["span_count"]
+                    rows[key]["duration_sum"] += row["duration_sum"]
+                    rows[key]["sketch"].merge(DDSketch.from_json(row["sketch"]))
+            statement = _dialect_insert(connection.dialect.name, rollup)
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=ROLLUP_KEYS,
+                    set_={
+                        name: statement.excluded[name]
+                        for name in ("span_count", "duration_sum", "sketch")
+                    },
+                ),
+                [
+                    {
+                        **dict(zip(ROLLUP_KEYS, key)),
+                        "span_count": values["span_count"],
+                        "duration_sum": values["duration_sum"],
+                        "sketch": values["sketch"].to_json(),
+                    }
+                    for key, values in rows.items()
+                ],
+            )
+
+    def rebuild_rollups(self) -> None:
+        """Recomputes the latency rollups from every span in the traces table."""
+        table = self.schema.traces
+        query = select(*(table.c[name] for name in ROLLUP_SPAN_COLUMNS))
+        with self.begin() as connection:
+            for rollup in self.schema.rollups.values():
+                connection.execute(rollup.delete())
+            # Spans are streamed over a second connection, rollups written on this one
+            for spans in self.iter_query(query, page_size=self.chunksize):
+                self._write_rollups(connection, self._rollup_rows(spans))
+        with self.begin() as connection:
+            self._bump_generation(connection)
+
+    def latency_summary(
+        self,
+        granularity: Literal["1m", "1h"] = "1m",
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """
+        Span count and duration mean/p50/p95/p99 (in microseconds) per service,
+        operation and status, read from the rollup buckets overlapping the range.
+        """
+        if not self._schema_ready:
+            self.ensure_schema()
+        rollup = self.schema.rollups[granularity]
+        query = select(rollup)
+        if start_time is not None:
+            width = ROLLUP_GRANULARITIES[granularity]
+            query = query.where(
+                rollup.c.bucket_start >= start_time - start_time % width
+            )
+        if end_time is not None:
+            query = query.where(rollup.c.bucket_start <= end_time)
+        summary: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        with self.connect() as connection:
+            for row in connection.execute(query).mappings():
+                key = (row["service_name"], row["operation_name"], row["status_code"])
+                sketch = DDSketch.from_json(row["sketch"])
+                if key in summary:
+                    summary[key]["span_count"] += row["span_count"]
+                    summary[key]["duration_sum"] += row["duration_sum"]
+                    summary[key]["sketch"].merge(sketch)
+                else:
+                    summary[key] = {
+                        "span_count": row["span_count"],
+                        "duration_sum": row["duration_sum"],
+                        "sketch": sketch,
+                    }
+        records = [
+            {
+                "service_name": key[0],
+                "operation_name": key[1],
+                "status_code": key[2],
+                "span_count": values["span_count"],
+                "avg_duration": values["duration_sum"] / values["span_count"],
+                "p50_duration": values["sketch"].quantile(0.5),
+                "p95_duration": values["sketch"].quantile(0.95),
+                "p99_duration": values["sketch"].quantile(0.99),
+            }
+            for key, values in summary.items()
+        ]
+        columns = [
+            "service_name",
+            "operation_name",
+            "status_code",
+            "span_count",
+            "avg_duration",
+            "p50_duration",
+            "p95_duration",
+            "p99_duration",
+        ]
+        return (
+            pd.DataFrame(records, columns=columns)
+            .sort_values("span_count", ascending=False)
+            .reset_index(drop=True)
         )
 
+    def _upsert(self, dataframe: pd.DataFrame, chunksize: Optional[int] = None) -> None:
+        if not self._schema_ready:
+            self.ensure_schema()
+        for chunk in self._batches(dataframe, chunksize):
+            if self.schema.partition_by_day:
+                self._ensure_partitions(chunk)
+            with self.begin() as connection:
+                self._upsert_chunk(connection, chunk)
+        if not dataframe.empty:
+            with self.begin() as connection:
+                self._bump_generation(connection)
+
+    async def _aupsert(
+        self, dataframe: pd.DataFrame, chunksize: Optional[int] = None
+    ) -> None:
+        """
+        `_upsert` through the async engine. The DataFrame and rollup work runs
+        in worker threads, only the statements run on the event loop.
+        """
+        engine = self._async_engine
+        if engine is None:
+            raise ValueError("No async engine was configured")
+        if not self._schema_ready:
+            await asyncio.to_thread(self.ensure_schema)
+        dialect = engine.dialect
+        batches = await asyncio.to_thread(list, self._batches(dataframe, chunksize))
+        for chunk in batches:
+            if self.schema.partition_by_day:
+                await asyncio.to_thread(self._ensure_partitions, chunk)
+            statements = await asyncio.to_thread(
+                self._insert_statements, dialect, chunk, False
+            )
+            async with engine.begin() as connection:
+                new_keys = await connection.run_sync(self._execute_inserts, statements)
+                inserted, known = await asyncio.to_thread(
+                    self._split_inserted, chunk, new_keys
+                )
+                if not known.empty:
+                    statements = await asyncio.to_thread(
+                        self._insert_statements, dialect, known, True
+                    )
+                    await connection.run_sync(self._execute_inserts, statements)
+                rollups = await asyncio.to_thread(self._rollup_rows, inserted)
+                await connection.run_sync(self._write_rollups, rollups)
+        if not dataframe.empty:
+            async with engine.begin() as connection:
+                await connection.run_sync(self._bump_generation)
+
+    def upsert_traces(self, data: Dict[str, Any]) -> int:
+        """
+        Upserts the spans of traces in the Jaeger JSON layout (`{"data": [...]}`),
+        returning how many were written.
+        """
+        df = self._to_pandas(data=data)
+        self._upsert(dataframe=df)
+        return len(df)
+
     def to_sql_database(
         self,
         start_time: Optional[int] = None,
         end_time: Optional[int] = None,
         limit: Optional[int] = None,
         if_exists_policy: Optional[Literal["fail", "replace", "append"]] = None,
+        incremental: bool = False,
+        lookback: int = 60 * 1000000,
     ) -> None:
+        if not incremental:
+            data = self._export(start_time=start_time, end_time=end_time, limit=limit)
+            df = self._to_pandas(data=data)
+            self._to_sql(dataframe=df, if_exists_policy=if_exists_policy)
+            return
+        # Only fetch what is newer than the last loaded span (minus a lookback for
+        # traces that were still running), and let the upsert drop the overlap
+        high_water_mark = self.get_high_water_mark()
+        if high_water_mark is not None:
+            start_time = max(start_time or 0, high_water_mark - lookback)
         data = self._export(start_time=start_time, end_time=end_time, limit=limit)
         df = self._to_pandas(data=data)
-        self._to_sql(dataframe=df, if_exists_policy=if_exists_policy)
+        if df.empty:
+            return
+        self._upsert(dataframe=df)
+        with self.begin() as connection:
+            self._set_metadata(
+                connection,
+                key=f"high_water_mark:{self.service_name}",
+                value=max(high_water_mark or 0, int(df["start_time"].max())),
+            )
 
-    def execute(
+    async def ato_sql_database(
+        self,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        limit: Optional[int] = None,
+        lookback: int = 60 * 1000000,
+    ) -> None:
+        """Incremental sync that writes through the async engine."""
+        if self._async_engine is None:
+            raise ValueError("No async engine was configured")
+        high_water_mark = await asyncio.to_thread(self.get_high_water_mark)
+        if high_water_mark is not None:
+            start_time = max(start_time or 0, high_water_mark - lookback)
+        data = await asyncio.to_thread(
+            self._export, start_time=start_time, end_time=end_time, limit=limit
+        )
+        df = await asyncio.to_thread(self._to_pandas, data=data)
+        if df.empty:
+            return
+        await self._aupsert(dataframe=df)
+        async with self._async_engine.begin() as connection:
+            await connection.run_sync(
+                self._set_metadata,
+                f"high_water_mark:{self.service_name}",
+                max(high_water_mark or 0, int(df["start_time"].max())),
+            )
+
+    def fetch_page(
+        self,
+        page_size: int = 100,
+        before: Optional[Tuple[int, str]] = None,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Most recent spans first, starting after the `(start_time, span_id)` in `before`."""
+        if not self._schema_ready:
+            self.ensure_schema()
+        table = self.schema.traces
+        query = (
+            select(table)
+            .order_by(table.c.start_time.desc(), table.c.span_id.desc())
+            .limit(page_size)
+        )
+        if start_time is not None:
+            query = query.where(table.c.start_time >= start_time)
+        if end_time is not None:
+            query = query.where(table.c.start_time <= end_time)
+        if before is not None:
+            query = query.where(
+                tuple_(table.c.start_time, table.c.span_id)
+                < tuple_(*(literal(value) for value in before))
+            )
+        with self.connect() as connection:
+            return pd.read_sql(sql=query, con=connection)
+
+    def fetch_traces(
+        self,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        trace_ids: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Every span of the traces with at least one span in the time range."""
+        if not self._schema_ready:
+            self.ensure_schema()
+        table = self.schema.traces
+        traces = select(table.c.trace_id).distinct()
+        if start_time is not None:
+            traces = traces.where(table.c.start_time >= start_time)
+        if end_time is not None:
+            traces = traces.where(table.c.start_time <= end_time)
+        if trace_ids is not None:
+            traces = traces.where(table.c.trace_id.in_(trace_ids))
+        query = select(table).where(table.c.trace_id.in_(traces))
+        with self.connect() as connection:
+            return pd.read_sql(sql=query, con=connection).astype(TRACES_DTYPES)
+
+    def filter_spans(
+        self,
+        attributes: Optional[Dict[str, Any]] = None,
+        tool_name: Optional[str] = None,
+        llm_model: Optional[str] = None,
+        min_tokens: Optional[int] = None,
+        min_duration: Optional[int] = None,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        order_by: Literal["duration", "start_time", "total_tokens"] = "duration",
+        limit: int = 100,
+    ) -> pd.DataFrame:
+        """
+        Spans matching every filter given, largest `order_by` first: e.g. the
+        slowest calls of a tool using more than `min_tokens` tokens in total.
+
+        The promoted attributes are filtered on their own indexed columns;
+        `attributes` matches the spans with all these attribute values, with
+        a containment (`@>`) query served by the GIN index on Postgres.
+        """
+        if not self._schema_ready:
+            self.ensure_schema()
+        table = self.schema.traces
+        query = select(table).order_by(table.c[order_by].desc()).limit(limit)
+        if order_by == "total_tokens":
+            query = query.where(table.c.total_tokens.is_not(None))
+        for name, value in (("tool_name", tool_name), ("llm_model", llm_model)):
+            if value is not None:
+                query = query.where(table.c[name] == value)
+        if min_tokens is not None:
+            query = query.where(table.c.total_tokens >= min_tokens)
+        if min_duration is not None:
+            query = query.where(table.c.duration >= min_duration)
+        if start_time is not None:
+            query = query.where(table.c.start_time >= start_time)
+        if end_time is not None:
+            query = query.where(table.c.start_time <= end_time)
+        with self.connect() as connection:
+            if attributes:
+                dialect_name = connection.dialect.name
+                if dialect_name == "postgresql":
+                    query = query.where(
+                        type_coerce(table.c.attributes, postgresql.JSONB).contains(
+                            attributes
+                        )
+                    )
+                elif dialect_name == "sqlite":
+                    for key, value in attributes.items():
+                        path = '$."' + key.replace('"', '\\"') + '"'
+                        query = query.where(
+                            func.json_extract(table.c.attributes, path) == value
+                        )
+                else:
+                    raise NotImplementedError(
+                        f"Attribute filters are not supported for {dialect_name} databases"
+                    )
+            return pd.read_sql(sql=query, con=connection)
+
+    def query_page(
         self,
         statement: str,
+        page: int = 0,
+        page_size: int = 100,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """
+        One page of the results of an arbitrary SELECT query.
+
+        With `start_time` or `end_time`, the traces table only holds the
+        spans starting in that (inclusive) time range for the query.
+
+        Pages are fetched with OFFSET, so each page gets slower the deeper it
+        is: the rows before it are still computed and skipped. That is fine
+        for free-form SQL, whose results can't be keyset-paged in general;
+        `fetch_page` pages the spans themselves at a constant cost.
+        """
+        statement = statement.strip().rstrip(";")
+        if start_time is not None or end_time is not None:
+            statement = self._in_time_range(statement, start_time, end_time)
+        query = text(
+            f"SELECT * FROM ({statement}) AS query_page LIMIT :page_size OFFSET :offset"
+        )
+        return self.execute(
+            query,
+            parameters={"page_size": page_size, "offset": page * page_size},
+            return_pandas=True,
+        )
+
+    def _in_time_range(
+        self, statement: str, start_time: Optional[int], end_time: Optional[int]
+    ) -> str:
+        # A CTE with the table's name shadows the table in the query, the
+        # schema-qualified name inside it still refers to the table itself
+        preparer = self._engine.dialect.identifier_preparer
+        name = preparer.quote(self.table_name)
+        schema = self.schema.traces.schema
+        if schema is None:
+            # The dialect only knows its default schema once it has connected
+            with self.connect() as connection:
+                schema = inspect(connection).default_schema_name
+        table = f"{preparer.quote_schema(schema)}.{name}" if schema else name
+        conditions = []
+        if start_time is not None:
+            conditions.append(f"start_time >= {int(start_time)}")
+        if end_time is not None:
+            conditions.append(f"start_time <= {int(end_time)}")
+        cte = f"{name} AS (SELECT * FROM {table} WHERE {' AND '.join(conditions)})"
+        # Queries with their own CTEs get one more
+        match = re.match(r"WITH(\s+RECURSIVE)?\s", statement, flags=re.IGNORECASE)
+        if match:
+            return f"{match.group(0)}{cte}, {statement[match.end() :]}"
+        return f"WITH {cte} {statement}"
+
+    def storage_bytes(self) -> int:
+        """Bytes used by the traces table, its partitions and rollups."""
+        with self.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                names = [self.table_name] + [
+                    rollup.name for rollup in self.schema.rollups.values()
+                ]
+                return int(
+                    connection.execute(
+                        text(
+                            "SELECT COALESCE(SUM(pg_total_relation_size(oid)), 0) "
+                            "FROM pg_class WHERE relname = ANY(:names) OR oid IN ("
+                            "SELECT inhrelid FROM pg_inherits "
+                            "WHERE inhparent = to_regclass(:table))"
+                        ),
+                        {"names": names, "table": self.table_name},
+                    ).scalar_one()
+                )
+            if connection.dialect.name == "sqlite":
+                # Pages on the freelist are reused by later writes
+                pages = connection.execute(text("PRAGMA page_count")).scalar_one()
+                free = connection.execute(text("PRAGMA freelist_count")).scalar_one()
+                size = connection.execute(text("PRAGMA page_size")).scalar_one()
+                return (pages - free) * size
+        return 0
+
+    def _delete_keys(self, connection: Connection, keys: List[Tuple[str, str]]) -> int:
+        table = self.schema.traces
+        deleted = 0
+        # Keep well below the bound parameter limit of SQLite
+        for start in range(0, len(keys), 400):
+            deleted += connection.execute(
+                table.delete().where(
+                    tuple_(table.c.trace_id, table.c.span_id).in_(
+                        keys[start : start + 400]
+                    )
+                )
+            ).rowcount
+        return deleted
+
+    def _delete_before(
+        self, cutoff: int, batch_size: int, start: Optional[int] = None
+    ) -> int:
+        """
+        Deletes every span that started before `cutoff` (and from `start`),
+        one batch per transaction.
+        """
+        table = self.schema.traces
+        in_range = table.c.start_time < cutoff
+        if start is not None:
+            in_range &= table.c.start_time >= start
+        deleted = 0
+        while True:
+            with self.begin() as connection:
+                keys = [
+                    tuple(row)
+                    for row in connection.execute(
+                        select(table.c.trace_id, table.c.span_id)
+                        .where(in_range)
+                        .limit(batch_size)
+                    )
+                ]
+                deleted += self._delete_keys(connection, keys)
+            if len(keys) < batch_size:
+                return deleted
+
+    def _prune_before(
+        self, start: int, cutoff: int, slow_threshold: int, batch_size: int
+    ) -> int:
+        """
+        Deletes the spans that started in [start, cutoff), except those of
+        traces with an error or a span lasting at least `slow_threshold`.
+        """
+        table = self.schema.traces
+        deleted = 0
+        last: Optional[Tuple[int, str]] = None
+        while True:
+            with self.begin() as connection:
+                query = (
+                    select(table.c.trace_id, table.c.span_id, table.c.start_time)
+                    .where(table.c.start_time >= start, table.c.start_time < cutoff)
+                    .order_by(table.c.start_time, table.c.span_id)
+                    .limit(batch_size)
+                )
+                if last is not None:
+                    query = query.where(
+                        tuple_(table.c.start_time, table.c.span_id)
+                        > tuple_(*(literal(value) for value in last))
+                    )
+                rows = connection.execute(query).all()
+                if not rows:
+                    return deleted
+                last = (rows[-1].start_time, rows[-1].span_id)
+                trace_ids = list({row.trace_id for row in rows})
+                kept: Set[str] = set()
+                for offset in range(0, len(trace_ids), 400):
+                    kept.update(
+                        connection.execute(
+                            select(table.c.trace_id)
+                            .distinct()
+                            .where(
+                                table.c.trace_id.in_(trace_ids[offset : offset + 400]),
+                                (table.c.status_code == "ERROR")
+                                | (table.c.duration >= slow_threshold),
+                            )
+                        ).scalars()
+                    )
+                deleted += self._delete_keys(
+                    connection,
+                    [
+                        (row.trace_id, row.span_id)
+                        for row in rows
+                        if row.trace_id not in kept
+                    ],
+                )
+            if len(rows) < batch_size:
+                return deleted
+
+    def _delete_rollups_before(
+        self, granularity: str, cutoff: int, batch_size: int
+    ) -> int:
+        rollup = self.schema.rollups[granularity]
+        keys = [rollup.c[name] for name in ROLLUP_KEYS]
+        deleted = 0
+        while True:
+            with self.begin() as connection:
+                batch = (
+                    select(*keys)
+                    .where(rollup.c.bucket_start < cutoff)
+                    .limit(batch_size)
+                )
+                count = connection.execute(
+                    rollup.delete().where(tuple_(*keys).in_(batch))
+                ).rowcount
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    def apply_retention(
+        self,
+        raw_days: float,
+        keep_days: float,
+        slow_threshold: int,
+        minute_rollup_days: Optional[float] = None,
+        hourly_rollup_days: Optional[float] = None,
+        batch_size: int = 5000,
+        compact: bool = True,
+        now: Optional[int] = None,
+    ) -> Dict[str, int]:
+        """
+        Keeps every span for `raw_days`, then only the spans of error and slow
+        traces (with a span lasting at least `slow_threshold` microseconds)
+        until `keep_days`, when they are deleted too. The minute and hourly
+        latency rollups, which summarize the deleted spans, are kept for
+        `minute_rollup_days` and `hourly_rollup_days` (forever when None).
+
+        Days past `keep_days` are dropped whole with `partition_by_day`;
+        everything else is deleted `batch_size` rows per transaction, so no
+        lock is held for long. With `compact`, Postgres tables are vacuumed
+        afterwards so the space can be reused.
+        """
+        if not self._schema_ready:
+            self.ensure_schema()
+        if now is None:
+            now = int(time.time() * 1000000)
+        raw_cutoff = int(now - raw_days * DAY)
+        keep_cutoff = int(now - keep_days * DAY)
+        bytes_before = self.storage_bytes()
+        report = {
+            "spans_deleted": 0,
+            "partitions_dropped": 0,
+            "rollup_rows_deleted": 0,
+            "bytes_reclaimed": 0,
+        }
+        if self.schema.partition_by_day:
+            with self.begin() as connection:
+                expired = [
+                    day_start
+                    for day_start in self.schema.partition_days(connection)
+                    if day_start + DAY <= keep_cutoff
+                ]
+                for day_start in expired:
+                    self.schema.drop_partition(connection, day_start)
+            report["partitions_dropped"] = len(expired)
+        report["spans_deleted"] += self._delete_before(keep_cutoff, batch_size)
+        # Spans before the last run's cutoff were already pruned
+        with self.connect() as connection:
+            pruned_until = self._get_metadata(connection, key=PRUNED_UNTIL_KEY) or 0
+        report["spans_deleted"] += self._prune_before(
+            max(pruned_until, keep_cutoff), raw_cutoff, slow_threshold, batch_size
+        )
+        with self.begin() as connection:
+            self._set_metadata(
+                connection, PRUNED_UNTIL_KEY, max(pruned_until, raw_cutoff)
+            )
+        for granularity, days in (
+            ("1m", minute_rollup_days),
+            ("1h", hourly_rollup_days),
+        ):
+            if days is not None:
+                report["rollup_rows_deleted"] += self._delete_rollups_before(
+                    granularity, int(now - days * DAY), batch_size
+                )
+        if report["spans_deleted"] or report["partitions_dropped"]:
+            with self.begin() as connection:
+                self._bump_generation(connection)
+        if compact and self._engine.dialect.name == "postgresql":
+            preparer = self._engine.dialect.identifier_preparer
+            with self._engine.connect() as connection:
+                connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+                for table in [self.schema.traces, *self.schema.rollups.values()]:
+                    connection.execute(
+                        text(f"VACUUM (ANALYZE) {preparer.quote(table.name)}")
+                    )
+        report["bytes_reclaimed"] = max(bytes_before - self.storage_bytes(), 0)
+        return report
+
+    def get_archived_until(self) -> Optional[int]:
+        """End of the last day moved to the archive, if any was."""
+        if not self._schema_ready:
+            self.ensure_schema()
+        with self.connect() as connection:
+            return self._get_metadata(connection, key=ARCHIVED_UNTIL_KEY)
+
+    def _archive_day_dir(self, day_start: int) -> str:
+        date = datetime.fromtimestamp(day_start / 1000000, tz=timezone.utc)
+        return os.path.join(
+            cast(str, self.archive_dir), self.table_name, f"day={date:%Y-%m-%d}"
+        )
+
+    def archive_partitions(
+        self, before: Optional[int] = None, batch_size: int = 5000
+    ) -> List[str]:
+        """
+        Moves the spans of every (UTC) day that ended by `before` (by default,
+        every day before today) from the traces table to Parquet files under
+        `archive_dir`, one `day=YYYY-MM-DD` directory per day. With
+        `partition_by_day`, the partitions of those days are dropped,
+        otherwise their spans are deleted `batch_size` rows per transaction.
+
+        Spans stored after their day was archived are only queried once the
+        next run has moved them to the archive too, where they replace the
+        archived spans with the same key.
+
+        Returns the directories written. The latency rollups are kept in the
+        database, but `rebuild_rollups` only sees the spans left there.
+        """
+        if self.archive_dir is None:
+            raise ValueError("No archive_dir was configured")
+        if not self._schema_ready:
+            self.ensure_schema()
+        if before is None:
+            before = int(time.time() * 1000000)
+        before -= before % DAY
+        table = self.schema.traces
+        with self.connect() as connection:
+            first = connection.execute(select(func.min(table.c.start_time))).scalar()
+            archived_until = self._get_metadata(connection, key=ARCHIVED_UNTIL_KEY)
+        if first is None or first >= before:
+            return []
+        written = []
+        for day_start in range(first - first % DAY, before, DAY):
+            day_end = day_start + DAY
+            directory = self._archive_day_dir(day_start)
+            staging = f"{directory}.tmp"
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            # Sorted by start time, so the row group statistics can prune scans
+            query = (
+                select(table)
+                .where(table.c.start_time >= day_start, table.c.start_time < day_end)
+                .order_by(table.c.start_time)
+            )
+            with duckdb.connect() as duck:
+                if os.path.isdir(directory):
+                    parts = self._rewrite_archived_day(duck, query, directory, staging)
+                else:
+                    parts = 0
+                    for part, spans in enumerate(
+                        self.iter_query(query, page_size=self.chunksize)
+                    ):
+                        duck.from_df(_with_json_text(spans)).write_parquet(
+                            os.path.join(staging, f"part-{part:05d}.parquet"),
+                            compression="zstd",
+                        )
+                        parts += 1
+            if parts:
+                shutil.rmtree(directory, ignore_errors=True)
+                os.replace(staging, directory)
+                written.append(directory)
+            else:
+                os.rmdir(staging)
+            # The files are in place before the spans leave the database, and
+            # queries stop reading the day from the database before its spans
+            # are deleted batch by batch
+            with self.begin() as connection:
+                if self.schema.partition_by_day:
+                    self.schema.drop_partition(connection, day_start)
+                archived_until = max(archived_until or 0, day_end)
+                self._set_metadata(connection, ARCHIVED_UNTIL_KEY, archived_until)
+                self._bump_generation(connection)
+            if not self.schema.partition_by_day and self._delete_before(
+                day_end, batch_size, start=day_start
+            ):
+                with self.begin() as connection:
+                    self._bump_generation(connection)
+        return written
+
+    def _rewrite_archived_day(
+        self,
+        duck: duckdb.DuckDBPyConnection,
+        query: Select,
+        directory: str,
+        staging: str,
+    ) -> int:
+        """
+        Writes the archived spans of a day with its spans still in the
+        database (stored after the day was archived, or left by an interrupted
+        run) to `staging`, the database's span winning when both have a key.
+        Returns the number of files written.
+        """
+        self._load_database_spans(duck, query)
+        (late,) = cast(
+            Tuple[int], duck.execute("SELECT COUNT(*) FROM database_spans").fetchone()
+        )
+        if not late:
+            return 0
+        files = sorted(
+            os.path.join(directory, file)
+            for file in os.listdir(directory)
+            if file.endswith(".parquet")
+        )
+        archived = (
+            f"SELECT *, 0 AS late FROM read_parquet([{', '.join(map(_sql_string, files))}], "
+            "union_by_name = true) UNION ALL BY NAME "
+            if files
+            else ""
+        )
+        duck.execute(
+            "COPY (SELECT * EXCLUDE (late) FROM ("
+            f"{archived}SELECT *, 1 AS late FROM database_spans) "
+            "QUALIFY row_number() OVER "
+            "(PARTITION BY trace_id, span_id ORDER BY late DESC) = 1 "
+            f"ORDER BY start_time) TO {_sql_string(os.path.join(staging, 'part-00000.parquet'))} "
+            "(FORMAT parquet, COMPRESSION zstd)"
+        )
+        return 1
+
+    def _load_database_spans(
+        self, duck: duckdb.DuckDBPyConnection, query: Optional[Select]
+    ) -> None:
+        """Streams the spans of a query into a `database_spans` DuckDB table."""
+        table = self.schema.traces
+        duck.execute(
+            "CREATE TABLE database_spans ("
+            + ", ".join(
+                f'"{c.name}" '
+                + ("BIGINT" if isinstance(c.type, BigInteger) else "VARCHAR")
+                for c in table.columns
+            )
+            + ")"
+        )
+        if query is None:
+            return
+        # Streamed in batches, DuckDB spills to disk past its memory limit
+        # where a DataFrame of every span would not
+        for spans in self.iter_query(query, page_size=self.chunksize):
+            duck.register("database_batch", _with_json_text(spans))
+            duck.execute(
+                "INSERT INTO database_spans BY NAME SELECT * FROM database_batch"
+            )
+            duck.unregister("database_batch")
+
+    def _archive_files(self, start_time: Optional[int], end_time: int) -> List[str]:
+        # Partition pruning: only the days overlapping the time range are read
+        root = os.path.join(cast(str, self.archive_dir), self.table_name)
+        if not os.path.isdir(root):
+            return []
+        files: List[str] = []
+        for name in sorted(os.listdir(root)):
+            if not name.startswith("day=") or name.endswith(".tmp"):
+                continue
+            day = datetime.strptime(name[4:], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            day_start = int(day.timestamp()) * 1000000
+            if day_start > end_time or (
+                start_time is not None and day_start + DAY <= start_time
+            ):
+                continue
+            directory = os.path.join(root, name)
+            files.extend(
+                os.path.join(directory, file)
+                for file in sorted(os.listdir(directory))
+                if file.endswith(".parquet")
+            )
+        return files
+
+    def route(
+        self, start_time: Optional[int] = None, end_time: Optional[int] = None
+    ) -> Literal["database", "archive", "both"]:
+        """Where the spans of a time range are stored."""
+        if self.archive_dir is None:
+            return "database"
+        archived_until = self.get_archived_until()
+        if archived_until is None or (
+            start_time is not None and start_time >= archived_until
+        ):
+            return "database"
+        if end_time is not None and end_time < archived_until:
+            return "archive"
+        return "both"
+
+    def query_traces(
+        self,
+        statement: str,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        page: int = 0,
+        page_size: int = 100,
+    ) -> pd.DataFrame:
+        """
+        One page of the results of a SELECT query over the traces table, run
+        where the spans of the time range are.
+
+        Ranges that only cover spans still in the database run there, as with
+        `query_page`. Otherwise the query runs on DuckDB, against a view
+        with the traces table's name holding the archived spans of the range
+        (read from the Parquet files of the days it overlaps) and the
+        database's spans of the range that are not archived yet.
+        """
+        route = self.route(start_time, end_time)
+        if route == "database":
+            return self.query_page(
+                statement,
+                page=page,
+                page_size=page_size,
+                start_time=start_time,
+                end_time=end_time,
+            )
+        parameters = {
+            "start_time": start_time,
+            "end_time": end_time,
+            "page": page,
+            "page_size": page_size,
+        }
+        key = (*self._cache_key(statement, parameters), self.get_generation(), route)
+        cached = self._query_cache.get(key)
+        if cached is None:
+            cached = self._query_archive(
+                statement,
+                start_time=start_time,
+                end_time=end_time,
+                include_database=route == "both",
+                page=page,
+                page_size=page_size,
+            )
+            self._query_cache.put(key, cached)
+        return cached.copy()
+
+    def _query_archive(
+        self,
+        statement: str,
+        start_time: Optional[int],
+        end_time: Optional[int],
+        include_database: bool,
+        page: int,
+        page_size: int,
+    ) -> pd.DataFrame:
+        archived_until = cast(int, self.get_archived_until())
+        archive_end = archived_until - 1
+        if end_time is not None:
+            archive_end = min(end_time, archive_end)
+        conditions = [f"start_time <= {int(archive_end)}"]
+        if start_time is not None:
+            conditions.append(f"start_time >= {int(start_time)}")
+        with duckdb.connect() as duck:
+            sources = []
+            files = self._archive_files(start_time, archive_end)
+            if files:
+                sources.append(
+                    # Days archived before a column was added don't have it
+                    f"SELECT * FROM read_parquet([{', '.join(map(_sql_string, files))}], "
+                    "union_by_name = true) "
+                    f"WHERE {' AND '.join(conditions)}"
+                )
+            if include_database or not files:
+                query = None
+                if include_database:
+                    table = self.schema.traces
+                    query = select(table).where(
+                        table.c.start_time >= max(start_time or 0, archived_until)
+                    )
+                    if end_time is not None:
+                        query = query.where(table.c.start_time <= end_time)
+                self._load_database_spans(duck, query)
+                sources.append("SELECT * FROM database_spans")
+            duck.execute(
+                f'CREATE VIEW "{self.table_name}" AS '
+                + " UNION ALL BY NAME ".join(sources)
+            )
+            return duck.execute(
+                f"SELECT * FROM ({statement.strip().rstrip(';')}) AS query_page "
+                "LIMIT ? OFFSET ?",
+                [page_size, page * page_size],
+            ).df()
+
+    def iter_query(
+        self,
+        statement: Union[str, Executable],
+        page_size: int = 1000,
+        parameters: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Streams the results of a query in pages over a server-side cursor."""
+        if isinstance(statement, str):
+            statement = text(statement)
+        with self._engine.connect() as connection:
+            connection = connection.execution_options(stream_results=True)
+            yield from pd.read_sql(
+                sql=statement, con=connection, params=parameters, chunksize=page_size
+            )
+
+    def _cache_key(
+        self,
+        statement: Union[str, Executable],
+        parameters: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]],
+    ) -> Tuple[str, str]:
+        params: Any = parameters
+        if isinstance(statement, ClauseElement):
+            compiled = statement.compile(dialect=self._engine.dialect)
+            sql = str(compiled)
+            if not isinstance(parameters, list):
+                params = {**compiled.params, **(parameters or {})}
+        else:
+            sql = str(statement)
+        # Only the surrounding whitespace and a trailing semicolon are dropped,
+        # whitespace inside the query may be part of a string literal
+        sql = sql.strip().removesuffix(";").rstrip()
+        return sql, json.dumps(params, sort_keys=True, default=str)
+
+    def execute(
+        self,
+        statement: Union[str, Executable],
         parameters: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None,
         execution_options: Optional[Dict[str, Any]] = None,
         return_pandas: bool = False,
+        use_cache: bool = True,
+    ) -> Union[Result, pd.DataFrame]:
+        """
+        Runs a statement in its own transaction.
+
+        With `return_pandas`, results are cached until new spans are written,
+        so the same query is answered from memory until the traces change.
+        """
+        if return_pandas and use_cache and self._query_cache.maxsize > 0:
+            # Read the generation first: a write that lands mid-query bumps it,
+            # so the result can only ever be cached under an older generation
+            key = (*self._cache_key(statement, parameters), self.get_generation())
+            cached = self._query_cache.get(key)
+            if cached is None:
+                cached = cast(
+                    pd.DataFrame,
+                    self.execute(
+                        statement, parameters, return_pandas=True, use_cache=False
+                    ),
+                )
+                self._query_cache.put(key, cached)
+            return cached.copy()
+        with self.begin() as connection:
+            if return_pandas:
+                return pd.read_sql(sql=statement, con=connection, params=parameters)
+            result = connection.execute(
+                text(statement) if isinstance(statement, str) else statement,
+                parameters,
+                execution_options=execution_options or {},
+            )
+            # Buffer the rows, the connection goes back to the pool on return
+            return result.freeze()() if result.returns_rows else result
+
+    async def aexecute(
+        self,
+        statement: Union[str, Executable],
+        parameters: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None,
+        return_pandas: bool = False,
     ) -> Union[Result, pd.DataFrame]:
-        if not self._connection:
-            self._connect()
-        if not return_pandas:
-            return self._connection.execute(
-                statement=statement,
-                parameters=parameters,
-                execution_options=execution_options,
+        if self._async_engine is None:
+            raise ValueError("No async engine was configured")
+        async with self._async_engine.begin() as connection:
+            if return_pandas:
+                return await connection.run_sync(
+                    lambda sync_connection: pd.read_sql(
+                        sql=statement, con=sync_connection, params=parameters
+                    )
+                )
+            result = await connection.execute(
+                text(statement) if isinstance(statement, str) else statement,
+                parameters,
             )
-        return pd.read_sql(sql=statement, con=self._connection)
+            return result.freeze()() if result.returns_rows else result
 
     def to_pandas(
         self,
     ) -> pd.DataFrame:
-        if not self._connection:
-            self._connect()
-        return pd.read_sql_table(table_name=self.table_name, con=self._connection)
+        with self.connect() as connection:
+            return pd.read_sql_table(table_name=self.table_name, con=connection)
 
     def disconnect(self) -> None:
-        if not self._connection:
-            raise ValueError("Engine was never connected!")
+        self._session.close()
         self._engine.dispose(close=True)
 
+    async def adisconnect(self) -> None:
+        self.disconnect()
+        if self._async_engine is not None:
+            await self._async_engine.dispose(close=True)
 
-async def extract_syllabus(filename: str) -> Union[str, None]:
+
+TRACER = get_tracer(__name__)
+
+
+@functools.cache
+def get_extraction_cache() -> ExtractionCache:
+    return ExtractionCache(
+        engine_url=os.getenv("EXTRACTION_CACHE_URL", "sqlite:///extraction_cache.db")
+    )
+
+
+def extraction_schema_version() -> str:
+    # Changing the fields of the extraction agent invalidates its cached results
+    schema = json.dumps(EXTRACT_AGENT.data_schema, sort_keys=True)
+    return hashlib.sha256(schema.encode()).hexdigest()[:16]
+
+
+INDEXER = BackgroundIndexer()
+# How long a question waits for its syllabi, if they are still being indexed
+INDEXING_WAIT_TIMEOUT = 120.0
+
+
+async def index_syllabus(filename: str, file_digest: Optional[str] = None) -> None:
     with open(filename, "rb") as f:
         file = await CLIENT.files.upload_file(upload_file=f)
     files = [{"file_id": file.id}]
     await CLIENT.pipelines.add_files_to_pipeline_api(
         pipeline_id=PIPELINE_ID, request=files
     )
-    extraction_output = await EXTRACT_AGENT.aextract(files=filename)
-    if extraction_output:
-        return json.dumps(extraction_output.data, indent=4)
+    if file_digest is not None:
+        # Lets later processes know the file is in the index
+        await asyncio.to_thread(get_extraction_cache().mark_indexed, file_digest)
+
+
+async def extract_syllabus_data(
+    filename: str, file_digest: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    file_digest = file_digest or file_sha256(filename)
+    cache = get_extraction_cache()
+    key = ExtractionCache.make_key(file_digest, extraction_schema_version())
+    with TRACER.start_as_current_span("extract_syllabus") as span:
+        span.set_attribute("extraction.cache.key", key)
+        # Files that were never indexed, or failed to be, are (re)queued, even
+        # when their extraction is cached; the extraction then runs meanwhile
+        if INDEXER.status(file_digest) in (None, "failed") and not (
+            await asyncio.to_thread(cache.is_indexed, file_digest)
+        ):
+            INDEXER.submit(file_digest, index_syllabus(filename, file_digest))
+        cached = await asyncio.to_thread(cache.get, key)
+        span.set_attribute("extraction.cache.hit", cached is not None)
+        if cached is not None:
+            return cast(Dict[str, Any], json.loads(cached))
+        extraction_output = await EXTRACT_AGENT.aextract(files=filename)
+        span.set_attribute("indexing.status", INDEXER.status(file_digest) or "")
+        if extraction_output:
+            data = cast(Dict[str, Any], extraction_output.data)
+            await asyncio.to_thread(
+                cache.put, key, json.dumps(data, separators=(",", ":"))
+            )
+            return data
+        return None
+
+
+async def extract_syllabus(filename: str) -> Union[str, None]:
+    data = await extract_syllabus_data(filename)
+    if data:
+        return json.dumps(data, indent=4)
     return None
 
 
-async def answer_question_about_course(question: str) -> Union[None, str]:
-    answer = await QE.aquery(question)
-    return cast(Union[None, str], answer.response)
+async def extract_syllabi(
+    paths: List[str],
+    max_concurrency: int = 4,
+    rate_limit: Optional[float] = None,
+    on_progress: Optional[Callable[[int, int, str], Awaitable[None]]] = None,
+) -> List[Dict[str, Any]]:
+    """Extracts many syllabi (files or directories of PDFs), see `extract_files`."""
+    return await extract_files(
+        paths,
+        extract_syllabus_data,
+        max_concurrency=max_concurrency,
+        rate_limit=rate_limit,
+        on_progress=on_progress,
+    )
+
+
+ANSWER_CACHE: LRUCache[str] = LRUCache(maxsize=256, ttl=10 * 60)
+ANSWERS_IN_FLIGHT = SingleFlight()
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+async def answer_question_about_course(
+    question: str, file_paths: Optional[List[str]] = None
+) -> Union[None, str]:
+    """
+    Answers a question from the syllabi indexed so far. If the question is
+    about the syllabi in `file_paths`, those are waited for first if they are
+    still being indexed, but not the other files being indexed.
+    """
+    if file_paths:
+        digests = []
+        for path in file_paths:
+            try:
+                digests.append(await asyncio.to_thread(file_sha256, path))
+            except OSError as e:
+                logger.warning("Failed to read %s: %s", path, e)
+        if not await INDEXER.wait(digests, timeout=INDEXING_WAIT_TIMEOUT):
+            logger.warning("Answering while %s are still indexing", file_paths)
+    # New files in the index can change any answer
+    key = (normalize_question(question), INDEXER.version)
+    with TRACER.start_as_current_span("answer_question") as span:
+        span.set_attribute("indexing.pending", INDEXER.pending)
+        answer = ANSWER_CACHE.get(key)
+        span.set_attribute("answer.cache.hit", answer is not None)
+        if answer is not None:
+            return answer
+        span.set_attribute("answer.coalesced", key in ANSWERS_IN_FLIGHT)
+
+        async def query() -> Union[None, str]:
+            response = cast(Union[None, str], (await QE.aquery(question)).response)
+            if response:
+                ANSWER_CACHE.put(key, response)
+            return response
+
+        return await ANSWERS_IN_FLIGHT.run(key, query)
@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Type
+from websockets.asyncio.server import ServerConnection, serve
+
+from src.agents_observability_demo.protocol import MultiplexedConnection
+
+
+class StubAgent:
+    """Agent run streaming `chunks` chunks per prompt (1000 for "long")."""
+
+    def __init__(self, chunks: int = 3, delay: float = 0.05) -> None:
+        self.chunks = chunks
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.prompts: List[str] = []
+        self.cancelled: List[str] = []
+        self.produced = 0
+
+    async def __call__(self, prompt: str) -> AsyncIterator[str]:
+        self.prompts.append(prompt)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            for i in range(self.chunks if prompt != "long" else 1000):
+                await asyncio.sleep(self.delay)
+                self.produced += 1
+                yield f"{prompt}:{i} "
+            if prompt == "fail":
+                raise RuntimeError("agent crashed")
+        except asyncio.CancelledError:
+            self.cancelled.append(prompt)
+            raise
+        finally:
+            self.running -= 1
+
+
+async def serve_stub(stub: StubAgent, port: int = 0, **kwargs: Any) -> Any:
+    """Serves the stub agent over the multiplexed websocket protocol."""
+    limit = asyncio.Semaphore(8)
+
+    async def handler(websocket: ServerConnection) -> None:
+        await MultiplexedConnection(
+            websocket, run=stub, global_limit=limit, **kwargs
+        ).serve()
+
+    return await serve(handler, "localhost", port, close_timeout=0.1)
+
+
+@pytest.fixture()
+def stub_agent() -> Type[StubAgent]:
+    return StubAgent
+
+
+@pytest.fixture()
+def start_server() -> Callable[..., Awaitable[Any]]:
+    return serve_stub
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import pytest
+import socket
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Iterator
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from src.agents_observability_demo import agent  # noqa: E402
+
+SERVER = """
+import sys
+from fastmcp import FastMCP, Context
+
+mcp = FastMCP("test")
+
+
+@mcp.tool()
+def add(a: int, b: int) -> int:
+    \"\"\"Adds two numbers\"\"\"
+    return a + b
+
+
+@mcp.tool()
+async def add_multiply_tool(ctx: Context) -> str:
+    \"\"\"Registers one more tool\"\"\"
+
+    @mcp.tool()
+    def multiply(a: int, b: int) -> int:
+        \"\"\"Multiplies two numbers\"\"\"
+        return a * b
+
+    await ctx.session.send_tool_list_changed()
+    return "ok"
+
+
+mcp.run(transport="streamable-http", host="127.0.0.1", port=int(sys.argv[1]))
+"""
+
+
+@pytest.fixture()
+def mcp_url(tmp_path: Path) -> Iterator[str]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    script = tmp_path / "server.py"
+    script.write_text(SERVER)
+    process = subprocess.Popen(
+        [sys.executable, str(script), str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    yield f"http://127.0.0.1:{port}/mcp"
+    process.terminate()
+    process.wait()
+
+
+def test_lazy_tools_and_session_reuse(
+    mcp_url: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    client = agent.PersistentMCPClient(mcp_url)
+    monkeypatch.setattr(agent, "mcp_client", client)
+    monkeypatch.setattr(agent, "_agent", None)
+    monkeypatch.setattr(agent, "_agent_lock", asyncio.Lock())
+
+    async def run() -> None:
+        first = await agent.get_agent()
+        assert [tool.metadata.name for tool in first.tools] == [
+            "add",
+            "add_multiply_tool",
+        ]
+        # Cached until the tool list changes
+        assert await agent.get_agent() is first
+        results = await asyncio.gather(
+            *(client.call_tool("add", {"a": i, "b": 1}) for i in range(10))
+        )
+        assert [result.content[0].text for result in results] == [
+            str(i + 1) for i in range(10)
+        ]
+        await client.call_tool("add_multiply_tool", {})
+        await asyncio.sleep(0.2)
+        second = await agent.get_agent()
+        assert [tool.metadata.name for tool in second.tools][-1] == "multiply"
+        # One session for the discoveries and all the calls
+        assert client.sessions_opened == 1
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_mcp_server_down() -> None:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    client = agent.PersistentMCPClient(f"http://127.0.0.1:{port}/mcp")
+
+    async def run() -> None:
+        with pytest.raises(ConnectionError, match="Could not reach"):
+            await client.list_tools()
+
+    asyncio.run(run())
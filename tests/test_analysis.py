@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+from src.agents_observability_demo.analysis import (
+    build_span_tree,
+    critical_path,
+    trace_summary,
+)
+
+
+@pytest.fixture()
+def agent_run() -> pd.DataFrame:
+    # The agent uploads the syllabus while the extraction is already running,
+    # and the extraction waits on the LLM; a second trace has an orphan span
+    return pd.DataFrame(
+        {
+            "trace_id": ["t1"] * 4 + ["t2"] * 2,
+            "span_id": ["run", "upload", "extract", "llm", "query", "orphan"],
+            "parent_span_id": [None, "run", "run", "extract", None, "missing"],
+            "operation_name": [
+                "FunctionAgent.run",
+                "syllabus_extractor_tool.upload",
+                "LlamaExtract.aextract",
+                "OpenAI.achat",
+                "QE.aquery",
+                "OpenAI.achat",
+            ],
+            "start_time": [0, 0, 10, 20, 1000, 1010],
+            "duration": [100, 40, 80, 40, 50, 20],
+        }
+    )
+
+
+def test_build_span_tree(agent_run: pd.DataFrame) -> None:
+    tree = build_span_tree(agent_run).set_index("span_id")
+    assert tree["depth"].to_dict() == {
+        "run": 0,
+        "upload": 1,
+        "extract": 1,
+        "llm": 2,
+        "query": 0,
+        "orphan": 0,
+    }
+    assert tree.loc["run", "children"] == 2
+    # upload and extract overlap: together they cover 90 of the 100us run
+    assert tree["self_time"].to_dict() == {
+        "run": 10,
+        "upload": 40,
+        "extract": 40,
+        "llm": 40,
+        "query": 50,
+        "orphan": 20,
+    }
+    path = critical_path(build_span_tree(agent_run), "t1")
+    assert path["span_id"].tolist() == ["run", "extract", "llm"]
+
+
+def test_trace_summary(agent_run: pd.DataFrame) -> None:
+    summary = trace_summary(build_span_tree(agent_run)).set_index("trace_id")
+    assert summary.loc["t1", "spans"] == 4
+    assert summary.loc["t1", "max_fan_out"] == 2
+    assert summary.loc["t1", "duration"] == 100
+    assert summary.loc["t1", "critical_path"] == (
+        "FunctionAgent.run > LlamaExtract.aextract > OpenAI.achat"
+    )
+    assert summary.loc["t1", "dominant_operation"] == "LlamaExtract.aextract"
+    assert summary.loc["t2", "duration"] == 50
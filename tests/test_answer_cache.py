@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import pytest
+
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from src.agents_observability_demo import utils
+
+
+class StubQueryEngine:
+    def __init__(self, delay: float = 0.05) -> None:
+        self.delay = delay
+        self.questions: List[str] = []
+
+    async def aquery(self, question: str) -> Any:
+        self.questions.append(question)
+        calls = len(self.questions)
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(response=f"answer {calls}")
+
+
+@pytest.fixture()
+def query_engine(monkeypatch: pytest.MonkeyPatch) -> StubQueryEngine:
+    query_engine = StubQueryEngine()
+    monkeypatch.setattr(utils, "QE", query_engine, raising=False)
+    monkeypatch.setattr(utils, "INDEXER", utils.BackgroundIndexer())
+    monkeypatch.setattr(utils, "ANSWER_CACHE", utils.LRUCache(maxsize=8, ttl=60))
+    monkeypatch.setattr(utils, "ANSWERS_IN_FLIGHT", utils.SingleFlight())
+    return query_engine
+
+
+def test_concurrent_questions_are_coalesced(query_engine: StubQueryEngine) -> None:
+    async def run() -> List[Any]:
+        return await asyncio.gather(
+            utils.answer_question_about_course("How is the course evaluated?"),
+            utils.answer_question_about_course("how is the course  evaluated"),
+            utils.answer_question_about_course("Who teaches the course?"),
+        )
+
+    answers = asyncio.run(run())
+    assert answers == ["answer 1", "answer 1", "answer 2"]
+    assert len(query_engine.questions) == 2
+
+
+def test_answers_are_cached_until_the_index_changes(
+    query_engine: StubQueryEngine,
+) -> None:
+    async def run() -> List[Any]:
+        question = "How is the course evaluated?"
+        first = await utils.answer_question_about_course(question)
+        cached = await utils.answer_question_about_course(question)
+
+        async def index() -> None:
+            await asyncio.sleep(0.01)
+
+        utils.INDEXER.submit("new-syllabus", index())
+        await utils.INDEXER.wait()
+        # The new syllabus is indexed: the question is asked again
+        fresh = await utils.answer_question_about_course(question)
+        return [first, cached, fresh]
+
+    assert asyncio.run(run()) == ["answer 1", "answer 1", "answer 2"]
+    assert len(query_engine.questions) == 2
+
+
+def test_questions_wait_only_for_their_syllabi(
+    query_engine: StubQueryEngine, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(utils, "INDEXING_WAIT_TIMEOUT", None)
+    syllabus = tmp_path / "syllabus.pdf"
+    syllabus.write_bytes(b"%PDF-1.4 statistics")
+    digest = hashlib.sha256(syllabus.read_bytes()).hexdigest()
+    seen_status: Dict[str, Any] = {}
+    aquery = query_engine.aquery
+
+    async def recording_aquery(question: str) -> Any:
+        seen_status[question] = utils.INDEXER.status(digest)
+        return await aquery(question)
+
+    monkeypatch.setattr(query_engine, "aquery", recording_aquery)
+
+    async def run() -> List[Any]:
+        stalled = asyncio.Event()
+
+        async def index_other() -> None:
+            await stalled.wait()
+
+        async def index_syllabus() -> None:
+            for _ in range(5):
+                await asyncio.sleep(0)
+
+        utils.INDEXER.submit("other-syllabus", index_other())
+        utils.INDEXER.submit(digest, index_syllabus())
+        # Neither question waits for the other syllabus, which never finishes
+        answers = await asyncio.wait_for(
+            asyncio.gather(
+                utils.answer_question_about_course(
+                    "How is it evaluated?", file_paths=[str(syllabus)]
+                ),
+                utils.answer_question_about_course("Who teaches it?"),
+            ),
+            timeout=5,
+        )
+        assert utils.INDEXER.status("other-syllabus") == "pending"
+        stalled.set()
+        return answers
+
+    assert asyncio.run(run()) == ["answer 2", "answer 1"]
+    # Only the question about the syllabus waited for it
+    assert seen_status == {
+        "How is it evaluated?": "indexed",
+        "Who teaches it?": "pending",
+    }
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.agents_observability_demo import extraction, utils
+
+
+class StubExtractor:
+    def __init__(self) -> None:
+        self.running = 0
+        self.max_running = 0
+        self.files: List[str] = []
+
+    async def __call__(
+        self, filename: str, file_digest: Optional[str] = None
+    ) -> Dict[str, Any]:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        # Lets the other extractions start, without depending on timing
+        for _ in range(3):
+            await asyncio.sleep(0)
+        self.running -= 1
+        self.files.append(filename)
+        if "broken" in filename:
+            raise RuntimeError("extraction failed")
+        return {"course_name": Path(filename).stem}
+
+
+@pytest.fixture()
+def syllabi(tmp_path: Path) -> Path:
+    for i in range(8):
+        (tmp_path / f"course{i}.pdf").write_bytes(f"%PDF-1.4 course {i}".encode())
+    (tmp_path / "course0 (copy).PDF").write_bytes(b"%PDF-1.4 course 0")
+    (tmp_path / "notes.txt").write_text("not a syllabus")
+    return tmp_path
+
+
+def run_batch(
+    paths: List[str], **kwargs: Any
+) -> Tuple[List[Dict[str, Any]], List[Tuple[int, int, str]]]:
+    progress: List[Tuple[int, int, str]] = []
+
+    async def on_progress(done: int, total: int, file: str) -> None:
+        progress.append((done, total, file))
+
+    results = asyncio.run(
+        utils.extract_syllabi(paths, on_progress=on_progress, **kwargs)
+    )
+    return results, progress
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 2, 4])
+def test_batch_throughput_scales(
+    syllabi: Path, monkeypatch: pytest.MonkeyPatch, max_concurrency: int
+) -> None:
+    extractor = StubExtractor()
+    monkeypatch.setattr(utils, "extract_syllabus_data", extractor)
+    results, progress = run_batch([str(syllabi)], max_concurrency=max_concurrency)
+    # The copy of course0 is extracted once, and notes.txt is skipped
+    assert len(results) == len(extractor.files) == 8
+    assert extractor.max_running == max_concurrency
+    duplicates = [result for result in results if "duplicates" in result]
+    assert [Path(path).name for path in duplicates[0]["duplicates"]] == ["course0.pdf"]
+    assert [done for done, _, _ in progress] == list(range(1, 9))
+    assert {total for _, total, _ in progress} == {8}
+
+
+def test_batch_rate_limit_and_errors(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    extractor = StubExtractor()
+    monkeypatch.setattr(utils, "extract_syllabus_data", extractor)
+    # The rate limiter's clock stands still, and its waits are recorded
+    monkeypatch.setattr(extraction.time, "monotonic", lambda: 0.0)
+    waits: List[float] = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(delay: float, *args: Any) -> Any:
+        if delay:
+            waits.append(delay)
+        return await sleep(0, *args)
+
+    monkeypatch.setattr(extraction.asyncio, "sleep", recording_sleep)
+    paths = []
+    for name in ("a.pdf", "b.pdf", "broken.pdf", "c.pdf"):
+        (tmp_path / name).write_bytes(name.encode())
+        paths.append(str(tmp_path / name))
+    results, _ = run_batch(paths, max_concurrency=4, rate_limit=10)
+    # Four extractions started 0.1s apart
+    assert waits == pytest.approx([0.1, 0.2, 0.3])
+    assert [result.get("error") for result in results] == [
+        None,
+        None,
+        "extraction failed",
+        None,
+    ]
+    assert results[0]["data"] == {"course_name": "a"}
+
+
+def test_batch_unreadable_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    extractor = StubExtractor()
+    monkeypatch.setattr(utils, "extract_syllabus_data", extractor)
+    (tmp_path / "a.pdf").write_bytes(b"a")
+    missing = str(tmp_path / "missing.pdf")
+    results, progress = run_batch([missing, str(tmp_path / "a.pdf")])
+    # The missing file fails on its own, the other file is still extracted
+    assert extractor.files == [str(tmp_path / "a.pdf")]
+    assert results[0]["data"] == {"course_name": "a"}
+    assert results[1]["file"] == missing
+    assert "No such file" in results[1]["error"]
+    assert [(done, total) for done, total, _ in progress] == [(1, 2), (2, 2)]
@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+import socket
+
+from contextlib import aclosing
+from typing import Any, Awaitable, Callable, Type
+
+from src.agents_observability_demo.client import AgentClient, AgentError
+from tests.conftest import StubAgent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+async def collect(client: AgentClient, prompt: str) -> str:
+    return "".join([chunk async for chunk in client.stream(prompt)])
+
+
+def test_connections_are_pooled(
+    stub_agent: Type[StubAgent], start_server: Callable[..., Awaitable[Any]]
+) -> None:
+    async def run() -> None:
+        stub = stub_agent(delay=0.01)
+        server = await start_server(stub)
+        port = server.sockets[0].getsockname()[1]
+        client = AgentClient(f"ws://localhost:{port}", pool_size=2)
+        answers = await asyncio.gather(*(collect(client, f"q{i}") for i in range(10)))
+        assert answers == [f"q{i}:0 q{i}:1 q{i}:2 " for i in range(10)]
+        for i in range(5):
+            assert await collect(client, "again") == "again:0 again:1 again:2 "
+        # 15 requests, 2 handshakes
+        assert client.connects == 2
+
+        with pytest.raises(AgentError, match="agent crashed"):
+            await collect(client, "fail")
+
+        # Leaving a stream early cancels the request on the server
+        async with aclosing(client.stream("long")) as stream:
+            async for chunk in stream:
+                break
+        await asyncio.sleep(0.1)
+        assert stub.cancelled == ["long"]
+
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
+
+
+def test_reconnect_with_backoff(
+    stub_agent: Type[StubAgent], start_server: Callable[..., Awaitable[Any]]
+) -> None:
+    async def run() -> None:
+        port = free_port()
+        client = AgentClient(
+            f"ws://localhost:{port}",
+            pool_size=1,
+            max_attempts=3,
+            initial_backoff=0.05,
+        )
+        start = asyncio.get_running_loop().time()
+        with pytest.raises(ConnectionError, match="after 3 attempts"):
+            await collect(client, "q")
+        # Two waits of 0.05s and 0.1s (with up to 50% jitter)
+        assert asyncio.get_running_loop().time() - start >= 0.075
+
+        stub = stub_agent(delay=0.01)
+        server = await start_server(stub, port)
+        assert await collect(client, "q") == "q:0 q:1 q:2 "
+
+        # The server restarts while a request is in flight
+        stream = client.stream("long")
+        assert await anext(stream) == "long:0 "
+        server.close()
+        await server.wait_closed()
+        with pytest.raises(ConnectionError, match="was lost"):
+            async for chunk in stream:
+                pass
+
+        server = await start_server(stub, port)
+        assert await collect(client, "q") == "q:0 q:1 q:2 "
+        assert client.connects == 2
+
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
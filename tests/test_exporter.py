@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.trace import Status, StatusCode
+from src.agents_observability_demo.exporter import SqlSpanExporter
+from src.agents_observability_demo.utils import OtelTracesSqlEngine
+
+
+def test_sql_span_exporter(tmp_path: Path) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test"
+    )
+    exporter = SqlSpanExporter(sql_engine=sql_engine)
+    provider = TracerProvider(resource=Resource({SERVICE_NAME: "agent.traces"}))
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer(__name__)
+    with tracer.start_as_current_span("FunctionAgent.run") as root:
+        with tracer.start_as_current_span("OpenAI.achat") as child:
+            child.add_event("retry", {"attempt": 2}, timestamp=1750618321000001000)
+            child.set_status(Status(StatusCode.ERROR))
+    provider.shutdown()
+
+    df = sql_engine.to_pandas().set_index("operation_name")
+    assert len(df) == 2
+    root_id = f"{root.get_span_context().span_id:016x}"
+    assert df.loc["FunctionAgent.run", "span_id"] == root_id
+    assert df.loc["FunctionAgent.run", "parent_span_id"] is None
+    assert df.loc["OpenAI.achat", "parent_span_id"] == root_id
+    assert df.loc["OpenAI.achat", "status_code"] == "ERROR"
+    assert df.loc["FunctionAgent.run", "status_code"] == ""
+    assert (df["service_name"] == "agent.traces").all()
+    assert (df["duration"] >= 0).all()
+    assert df["trace_id"].nunique() == 1
+    # Span events are stored like the logs of spans synced from Jaeger
+    assert df.loc["OpenAI.achat", "events"] == [
+        {"timestamp": 1750618321000001, "fields": {"event": "retry", "attempt": 2}}
+    ]
+    assert df.loc["FunctionAgent.run", "events"] == []
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import pytest
+
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from src.agents_observability_demo import utils
+from src.agents_observability_demo.extraction import ExtractionCache
+
+
+def test_extraction_cache_eviction(tmp_path: Path) -> None:
+    cache = ExtractionCache(
+        engine_url=f"sqlite:///{tmp_path / 'cache.db'}", max_bytes=10
+    )
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    # "b" is now the least recently used entry
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+    cache.close()
+
+    expired = ExtractionCache(engine_url=f"sqlite:///{tmp_path / 'cache.db'}", ttl=0)
+    assert expired.get("a") is None
+    expired.close()
+
+
+class FakeLlamaCloud:
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        # Holds the files back from the pipeline until set
+        self.release: Optional[asyncio.Event] = None
+        self.uploads: List[str] = []
+        self.files = SimpleNamespace(upload_file=self.upload_file)
+        self.pipelines = SimpleNamespace(add_files_to_pipeline_api=self.add_files)
+
+    async def upload_file(self, upload_file: Any) -> Any:
+        self.uploads.append(upload_file.name)
+        return SimpleNamespace(id="file-1")
+
+    async def add_files(self, pipeline_id: str, request: Any) -> None:
+        if self.release is not None:
+            await self.release.wait()
+        if self.fail:
+            raise RuntimeError("pipeline unavailable")
+
+
+class FakeExtractAgent:
+    data_schema = {"properties": {"course_name": {"type": "string"}}}
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def aextract(self, files: str) -> Any:
+        self.calls += 1
+        return SimpleNamespace(data={"course_name": "Thermodynamics"})
+
+
+def test_extract_syllabus_cache(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    client, agent = FakeLlamaCloud(), FakeExtractAgent()
+    cache = ExtractionCache(engine_url=f"sqlite:///{tmp_path / 'cache.db'}")
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(utils, "CLIENT", client, raising=False)
+    monkeypatch.setattr(utils, "EXTRACT_AGENT", agent, raising=False)
+    monkeypatch.setattr(utils, "PIPELINE_ID", "pipeline-1", raising=False)
+    monkeypatch.setattr(utils, "get_extraction_cache", lambda: cache)
+    monkeypatch.setattr(utils, "TRACER", provider.get_tracer(__name__))
+    monkeypatch.setattr(utils, "INDEXER", utils.BackgroundIndexer())
+    syllabus = tmp_path / "syllabus.pdf"
+    syllabus.write_bytes(b"%PDF-1.4 thermodynamics")
+    resubmitted = tmp_path / "syllabus (1).pdf"
+    resubmitted.write_bytes(b"%PDF-1.4 thermodynamics")
+
+    first = asyncio.run(utils.extract_syllabus(filename=str(syllabus)))
+    second = asyncio.run(utils.extract_syllabus(filename=str(resubmitted)))
+    assert first == second
+    assert agent.calls == 1
+    assert len(client.uploads) == 1
+    hits = [
+        span.attributes["extraction.cache.hit"]
+        for span in exporter.get_finished_spans()
+    ]
+    assert hits == [False, True]
+
+    # A new extraction schema misses the cache
+    agent.data_schema = {"properties": {"summary": {"type": "string"}}}
+    asyncio.run(utils.extract_syllabus(filename=str(syllabus)))
+    assert agent.calls == 2
+    cache.close()
+
+
+def test_failed_indexing_is_requeued(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    client, agent = FakeLlamaCloud(fail=True), FakeExtractAgent()
+    cache = ExtractionCache(engine_url=f"sqlite:///{tmp_path / 'cache.db'}")
+    monkeypatch.setattr(utils, "CLIENT", client, raising=False)
+    monkeypatch.setattr(utils, "EXTRACT_AGENT", agent, raising=False)
+    monkeypatch.setattr(utils, "PIPELINE_ID", "pipeline-1", raising=False)
+    monkeypatch.setattr(utils, "get_extraction_cache", lambda: cache)
+    syllabus = tmp_path / "syllabus.pdf"
+    syllabus.write_bytes(b"%PDF-1.4 thermodynamics")
+    digest = hashlib.sha256(syllabus.read_bytes()).hexdigest()
+
+    async def run_process() -> None:
+        # Every process starts without knowing what was indexed before
+        monkeypatch.setattr(utils, "INDEXER", utils.BackgroundIndexer())
+        assert await utils.extract_syllabus(filename=str(syllabus))
+        await utils.INDEXER.wait()
+
+    asyncio.run(run_process())
+    assert not cache.is_indexed(digest)
+    client.fail = False
+    asyncio.run(run_process())
+    # The extraction is cached, but the file was not indexed: it is queued again
+    assert agent.calls == 1
+    assert cache.is_indexed(digest)
+    asyncio.run(run_process())
+    assert len(client.uploads) == 2
+    cache.close()
+
+
+def test_extraction_overlaps_indexing(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    indexer = utils.BackgroundIndexer()
+    seen_status: List[Any] = []
+    syllabus = tmp_path / "syllabus.pdf"
+    syllabus.write_bytes(b"%PDF-1.4 statistics")
+    digest = hashlib.sha256(syllabus.read_bytes()).hexdigest()
+
+    async def aquery(question: str) -> Any:
+        seen_status.append(indexer.status(digest))
+        return SimpleNamespace(response="Exams are written.")
+
+    client = FakeLlamaCloud()
+    monkeypatch.setattr(utils, "CLIENT", client, raising=False)
+    monkeypatch.setattr(utils, "EXTRACT_AGENT", FakeExtractAgent(), raising=False)
+    monkeypatch.setattr(utils, "PIPELINE_ID", "pipeline-1", raising=False)
+    monkeypatch.setattr(utils, "QE", SimpleNamespace(aquery=aquery), raising=False)
+    monkeypatch.setattr(
+        utils,
+        "get_extraction_cache",
+        lambda: ExtractionCache(engine_url=f"sqlite:///{tmp_path / 'cache.db'}"),
+    )
+    monkeypatch.setattr(utils, "INDEXER", indexer)
+    monkeypatch.setattr(utils, "ANSWER_CACHE", utils.LRUCache(maxsize=8))
+
+    async def run() -> None:
+        client.release = asyncio.Event()
+        # The extraction completes while the file is still being indexed
+        assert await utils.extract_syllabus(filename=str(syllabus))
+        assert indexer.status(digest) == "pending"
+        answer = asyncio.create_task(
+            utils.answer_question_about_course(
+                "How is it evaluated?", file_paths=[str(syllabus)]
+            )
+        )
+        await asyncio.sleep(0)
+        assert not answer.done()
+        client.release.set()
+        assert await answer == "Exams are written."
+
+    asyncio.run(run())
+    # The question waited for the file to be indexed
+    assert seen_status == ["indexed"]
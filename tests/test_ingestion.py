@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from src.agents_observability_demo.ingestion import TraceIngestionService
+from typing import Any, List, Tuple
+
+
+class RecordingSqlEngine:
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls: List[Tuple[int, int]] = []
+
+    def to_sql_database(self, start_time: int, end_time: int, **kwargs: Any) -> None:
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("database is down")
+        self.calls.append((start_time, end_time))
+
+
+def test_windows_are_coalesced() -> None:
+    async def run() -> Tuple[RecordingSqlEngine, TraceIngestionService]:
+        sql_engine = RecordingSqlEngine()
+        service = TraceIngestionService(sql_engine=sql_engine, flush_interval=0.2)  # type: ignore[arg-type]
+        service.start()
+        for start, end in [(10, 20), (5, 15), (18, 30)]:
+            assert service.submit(start_time=start, end_time=end)
+        await service.stop()
+        return sql_engine, service
+
+    sql_engine, service = asyncio.run(run())
+    assert sql_engine.calls == [(5, 30)]
+    assert service.stats.batches_written == 1
+    assert service.stats.windows_written == 3
+    assert service.stats.last_lag > 0
+
+
+def test_full_queue_drops_windows() -> None:
+    async def run() -> TraceIngestionService:
+        service = TraceIngestionService(
+            sql_engine=RecordingSqlEngine(),  # type: ignore[arg-type]
+            max_queue_size=2,
+        )
+        results = [service.submit(start_time=i, end_time=i + 1) for i in range(3)]
+        assert results == [True, True, False]
+        service.start()
+        await service.stop()
+        return service
+
+    service = asyncio.run(run())
+    assert service.stats.dropped == 1
+    assert service.stats.windows_written == 2
+
+
+def test_event_loop_is_not_blocked() -> None:
+    async def run() -> Tuple[int, TraceIngestionService]:
+        service = TraceIngestionService(
+            sql_engine=RecordingSqlEngine(delay=0.3, fail=True),  # type: ignore[arg-type]
+            flush_interval=0,
+        )
+        service.start()
+        service.submit(start_time=1, end_time=2)
+        ticks = 0
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await service.stop()
+        return ticks, service
+
+    ticks, service = asyncio.run(run())
+    assert ticks > 10
+    assert service.stats.failed_batches == 1
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import pytest
+
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple, Type
+from websockets.asyncio.client import connect
+
+from src.agents_observability_demo.protocol import coalesce, encode_message
+from tests.conftest import StubAgent
+
+
+def url(server: Any) -> str:
+    return f"ws://localhost:{server.sockets[0].getsockname()[1]}"
+
+
+def test_requests_are_multiplexed(
+    stub_agent: Type[StubAgent], start_server: Callable[..., Awaitable[Any]]
+) -> None:
+    async def run() -> Dict[str, List[Dict[str, Any]]]:
+        stub = stub_agent()
+        server = await start_server(stub, max_concurrent_requests=2)
+        frames: Dict[str, List[Dict[str, Any]]] = {}
+        async with connect(url(server)) as websocket:
+            for request_id in ("a", "b", "c"):
+                await websocket.send(
+                    encode_message("run", request_id, prompt=request_id)
+                )
+            await websocket.send(encode_message("run", "d", prompt="fail"))
+            done = 0
+            async for raw in websocket:
+                message = json.loads(raw)
+                frames.setdefault(message["id"], []).append(message)
+                if message["type"] != "chunk":
+                    done += 1
+                    if done == 4:
+                        break
+        server.close()
+        await server.wait_closed()
+        # Two requests at a time on this connection
+        assert stub.max_running == 2
+        return frames
+
+    frames = asyncio.run(run())
+    for request_id in ("a", "b", "c"):
+        assert [frame["type"] for frame in frames[request_id]] == [
+            "chunk",
+            "chunk",
+            "chunk",
+            "end",
+        ]
+        content = "".join(frame.get("content", "") for frame in frames[request_id])
+        assert content == f"{request_id}:0 {request_id}:1 {request_id}:2 "
+    assert frames["d"][-1] == {"type": "error", "id": "d", "error": "agent crashed"}
+
+
+def test_cancel_and_disconnect(
+    stub_agent: Type[StubAgent], start_server: Callable[..., Awaitable[Any]]
+) -> None:
+    async def run() -> StubAgent:
+        stub = stub_agent(chunks=100, delay=0.01)
+        server = await start_server(stub)
+        async with connect(url(server)) as websocket:
+            await websocket.send(encode_message("run", "a", prompt="a"))
+            await websocket.send(encode_message("run", "b", prompt="b"))
+            cancelled = False
+            while not cancelled:
+                message = json.loads(await websocket.recv())
+                if message == {"type": "chunk", "id": "a", "content": "a:0 "}:
+                    await websocket.send(encode_message("cancel", "a"))
+                cancelled = message["type"] == "cancelled"
+            assert message["id"] == "a"
+        # Closing the connection cancels "b"
+        await asyncio.sleep(0.1)
+        server.close()
+        await server.wait_closed()
+        return stub
+
+    stub = asyncio.run(run())
+    assert sorted(stub.cancelled) == ["a", "b"]
+    assert stub.running == 0
+
+
+def test_slow_reader_applies_backpressure(
+    stub_agent: Type[StubAgent], start_server: Callable[..., Awaitable[Any]]
+) -> None:
+    async def run() -> int:
+        stub = stub_agent(chunks=10000, delay=0)
+        server = await start_server(stub, max_pending_messages=4)
+        # Uncompressed, so the socket buffers fill up quickly
+        async with connect(
+            url(server), max_queue=1, compression=None, close_timeout=0.1
+        ) as websocket:
+            await websocket.send(encode_message("run", "a", prompt="x" * 10000))
+            await asyncio.sleep(0.5)
+            # The agent is paused once the socket buffers and the queue are full
+            produced = stub.produced
+            await asyncio.sleep(0.2)
+            assert stub.produced == produced
+        server.close()
+        await server.wait_closed()
+        return produced
+
+    assert asyncio.run(run()) < 10000
+
+
+def test_coalesce_tokens() -> None:
+    async def tokens(count: int, delay: float) -> AsyncIterator[str]:
+        for i in range(count):
+            await asyncio.sleep(delay)
+            yield f"{i} "
+
+    async def collect(chunks: AsyncIterator[str]) -> List[Tuple[float, str]]:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        return [(loop.time() - start, chunk) async for chunk in chunks]
+
+    async def run() -> None:
+        # 200 tokens over about 0.2s are sent in a handful of frames
+        frames = await collect(coalesce(tokens(200, 0.001), interval=0.05))
+        assert "".join(chunk for _, chunk in frames) == "".join(
+            f"{i} " for i in range(200)
+        )
+        assert len(frames) <= 10
+        # The first token is not held back
+        assert frames[0] == (pytest.approx(0, abs=0.02), "0 ")
+        # Frames are capped in size
+        frames = await collect(coalesce(tokens(200, 0), interval=10, max_size=100))
+        assert max(len(chunk) for _, chunk in frames[:-1]) < 110
+        # Tokens slower than the interval are not merged
+        frames = await collect(coalesce(tokens(5, 0.03), interval=0.01))
+        assert len(frames) == 5
+
+    asyncio.run(run())
+
+
+def test_coalesce_propagates_errors_and_cancellation(
+    stub_agent: Type[StubAgent],
+) -> None:
+    stub = stub_agent(chunks=100, delay=0.01)
+
+    async def run() -> List[str]:
+        received: List[str] = []
+
+        async def consume(prompt: str) -> None:
+            async for chunk in coalesce(stub(prompt), interval=0.02):
+                received.append(chunk)
+
+        task = asyncio.create_task(consume("a"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert stub.cancelled == ["a"]
+        assert stub.running == 0
+
+        # Buffered chunks are delivered before the error
+        failing = stub_agent(chunks=3, delay=0)
+        with pytest.raises(RuntimeError, match="agent crashed"):
+            async for chunk in coalesce(failing("fail"), interval=10):
+                received.append(chunk)
+        return received
+
+    assert asyncio.run(run())[-1] == "fail:1 fail:2 "
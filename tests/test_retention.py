@@ -0,0 +1,98 @@
+import asyncio
+import pandas as pd
+
+from pathlib import Path
+
+from src.agents_observability_demo.retention import RetentionPolicy, RetentionService
+from src.agents_observability_demo.utils import OtelTracesSqlEngine
+
+DAY = 24 * 60 * 60 * 1000000
+NOW = 1750618321000000
+
+
+def make_trace(trace_id: str, age_days: float, status: str, duration: int) -> dict:
+    start_time = int(NOW - age_days * DAY)
+    return {
+        "trace_id": [trace_id] * 3,
+        "span_id": [f"{trace_id}-{i}" for i in range(3)],
+        "parent_span_id": [None, f"{trace_id}-0", f"{trace_id}-0"],
+        "operation_name": ["FunctionAgent.run", "OpenAI.achat", "OpenAI.achat"],
+        "start_time": [start_time, start_time + 10, start_time + 20],
+        "duration": [duration, 100, 100],
+        "status_code": ["OK", status, "OK"],
+        "service_name": ["agent.traces"] * 3,
+    }
+
+
+def test_retention_policy(tmp_path: Path) -> None:
+    traces = [
+        make_trace("expired-error", 100, "ERROR", 1000),
+        make_trace("old-ok", 30, "OK", 1000),
+        make_trace("old-error", 30, "ERROR", 1000),
+        make_trace("old-slow", 30, "OK", 20 * 1000000),
+        make_trace("recent", 1, "OK", 1000),
+    ]
+    spans = pd.concat([pd.DataFrame(trace) for trace in traces])
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test"
+    )
+    sql_engine._to_sql(dataframe=spans)
+    generation = sql_engine.get_generation()
+
+    report = sql_engine.apply_retention(
+        raw_days=7,
+        keep_days=90,
+        slow_threshold=10 * 1000000,
+        minute_rollup_days=7,
+        batch_size=2,
+        now=NOW,
+    )
+    assert report["spans_deleted"] == 6
+    remaining = sql_engine.execute(
+        "SELECT DISTINCT trace_id FROM test ORDER BY trace_id", return_pandas=True
+    )
+    assert remaining["trace_id"].tolist() == ["old-error", "old-slow", "recent"]
+    assert sql_engine.get_generation() > generation
+    # Minute buckets are downsampled away, hourly ones still cover every span
+    minutes = sql_engine.latency_summary(granularity="1m")
+    assert minutes["span_count"].sum() == 3
+    assert sql_engine.latency_summary(granularity="1h")["span_count"].sum() == 15
+    assert report["rollup_rows_deleted"] > 0
+
+    # A second run has nothing left to delete
+    again = sql_engine.apply_retention(
+        raw_days=7, keep_days=90, slow_threshold=10 * 1000000, now=NOW
+    )
+    assert again["spans_deleted"] == 0
+    sql_engine.disconnect()
+
+
+def test_retention_service(tmp_path: Path) -> None:
+    spans = pd.concat(
+        [
+            pd.DataFrame(make_trace(f"t{i}", 30, "OK", 1000)).assign(
+                operation_name="x" * 1000
+            )
+            for i in range(200)
+        ]
+    )
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test"
+    )
+    sql_engine._to_sql(dataframe=spans)
+
+    async def run() -> RetentionService:
+        service = RetentionService(
+            sql_engine, policy=RetentionPolicy(raw_days=7), interval=3600
+        )
+        service.start()
+        while service.stats.runs == 0:
+            await asyncio.sleep(0.01)
+        await service.stop()
+        return service
+
+    service = asyncio.run(run())
+    assert service.stats.spans_deleted == 600
+    assert service.stats.last_report.bytes_reclaimed > 600 * 1000
+    assert service.stats.failed_runs == 0
+    sql_engine.disconnect()
@@ -0,0 +1,100 @@
+import time
+
+from typing import Tuple
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import Status, StatusCode
+from src.agents_observability_demo.sampling import TailSamplingSpanProcessor
+
+START_TIME = 1750618321000000000
+
+
+def make_tracer(
+    sampler: TailSamplingSpanProcessor,
+) -> Tuple[trace.Tracer, InMemorySpanExporter]:
+    exporter = InMemorySpanExporter()
+    sampler.add_span_processor(SimpleSpanProcessor(exporter))
+    provider = TracerProvider()
+    provider.add_span_processor(sampler)
+    return provider.get_tracer(__name__), exporter
+
+
+def run_trace(tracer: trace.Tracer, duration: int, error: bool = False) -> int:
+    """Records a root span with one child, returning the trace id."""
+    root = tracer.start_span("FunctionAgent.run", start_time=START_TIME)
+    child = tracer.start_span(
+        "OpenAI.achat",
+        context=trace.set_span_in_context(root),
+        start_time=START_TIME + 10,
+    )
+    if error:
+        child.set_status(Status(StatusCode.ERROR))
+    child.end(end_time=START_TIME + duration // 2)
+    root.end(end_time=START_TIME + duration)
+    return root.get_span_context().trace_id
+
+
+def test_tail_sampling() -> None:
+    sampler = TailSamplingSpanProcessor(
+        sample_rate=0, latency_percentile=90, min_traces=10
+    )
+    tracer, exporter = make_tracer(sampler)
+    for _ in range(20):
+        run_trace(tracer, duration=1000000)
+    error = run_trace(tracer, duration=1000000, error=True)
+    slow = run_trace(tracer, duration=100000000)
+    # Whole traces are exported, once complete
+    assert sorted(
+        span.context.trace_id for span in exporter.get_finished_spans()
+    ) == sorted([error, error, slow, slow])
+    assert sampler.stats.traces_kept == 2
+    assert sampler.stats.traces_dropped == 20
+    assert sampler.stats.kept_errors == 1
+    assert sampler.stats.kept_slow == 1
+    assert sampler.stats.spans_dropped == 40
+    sampler.shutdown()
+
+    sampler = TailSamplingSpanProcessor(sample_rate=0.5, min_traces=1000)
+    tracer, exporter = make_tracer(sampler)
+    kept = 0
+    for _ in range(400):
+        exporter.clear()
+        run_trace(tracer, duration=1000000)
+        kept += len(exporter.get_finished_spans()) == 2
+    assert 150 < kept < 250
+    assert sampler.stats.kept_sampled == kept
+    sampler.shutdown()
+
+
+def test_tail_sampling_bounds() -> None:
+    sampler = TailSamplingSpanProcessor(sample_rate=1, decision_wait=0.1)
+    tracer, exporter = make_tracer(sampler)
+    root = tracer.start_span("FunctionAgent.run")
+    tracer.start_span("OpenAI.achat", context=trace.set_span_in_context(root)).end()
+    assert exporter.get_finished_spans() == ()
+    # Incomplete traces are decided after decision_wait, late spans follow
+    deadline = time.monotonic() + 5
+    while not exporter.get_finished_spans() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert sampler.stats.traces_timed_out == 1
+    root.end()
+    assert len(exporter.get_finished_spans()) == 2
+    sampler.shutdown()
+
+    sampler = TailSamplingSpanProcessor(sample_rate=1, max_spans=3)
+    tracer, exporter = make_tracer(sampler)
+    roots = []
+    for _ in range(5):
+        roots.append(tracer.start_span("FunctionAgent.run"))
+        tracer.start_span(
+            "OpenAI.achat", context=trace.set_span_in_context(roots[-1])
+        ).end()
+    # The oldest traces are decided early to stay within max_spans
+    assert sampler.stats.traces_evicted == 2
+    assert len(exporter.get_finished_spans()) == 2
+    sampler.shutdown()
+    assert sampler.stats.traces_kept == 5
@@ -1,10 +1,22 @@
+import json
 import socket
+import threading
 import pytest
 import pandas as pd
+import numpy as np
 import os
 
-from src.agents_observability_demo.utils import OtelTracesSqlEngine
-from sqlalchemy import text
+from src.agents_observability_demo.utils import (
+    DDSketch,
+    OtelTracesSqlEngine,
+    TRACES_DTYPES,
+)
+from sqlalchemy import text, create_engine, inspect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
 
 ENV = load_dotenv()
@@ -82,3 +94,529 @@ def test_engine(otel_data: pd.DataFrame) -> None:
         return_pandas=True,
     )
     assert isinstance(res3, pd.DataFrame)
+
+
+@pytest.fixture()
+def jaeger_data() -> Dict[str, Any]:
+    return {
+        "data": [
+            {
+                "traceID": "abc123",
+                "processes": {"p1": {"serviceName": "agent.traces"}},
+                "spans": [
+                    {
+                        "spanID": "span1",
+                        "operationName": "FunctionAgent.run",
+                        "startTime": 1750618321000000,
+                        "duration": 150,
+                        "processID": "p1",
+                        "references": [],
+                        "tags": [{"key": "otel.status_code", "value": "OK"}],
+                    },
+                    {
+                        "spanID": "span2",
+                        "operationName": "OpenAI.achat",
+                        "startTime": 1750618321000100,
+                        "duration": 300,
+                        "processID": "p1",
+                        "references": [{"refType": "CHILD_OF", "spanID": "span1"}],
+                        "tags": [
+                            {"key": "span.kind", "value": "internal"},
+                            {"key": "otel.status_code", "value": "ERROR"},
+                        ],
+                    },
+                ],
+            }
+        ]
+    }
+
+
+def test_to_pandas(jaeger_data: Dict[str, Any]) -> None:
+    sql_engine = OtelTracesSqlEngine(engine=create_engine("sqlite://"))
+    df = sql_engine._to_pandas(data=jaeger_data)
+    assert list(df.columns) == list(TRACES_DTYPES)
+    assert df["start_time"].dtype == "int64"
+    assert df["duration"].dtype == "int64"
+    for column in ("service_name", "operation_name", "status_code"):
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    assert df["parent_span_id"].tolist() == [None, "span1"]
+    assert df["status_code"].tolist() == ["OK", "ERROR"]
+    assert df["service_name"].tolist() == ["agent.traces", "agent.traces"]
+    empty = sql_engine._to_pandas(data={"data": []})
+    assert empty.empty
+    assert empty["start_time"].dtype == "int64"
+
+
+def test_to_sql_batches(otel_data: pd.DataFrame, tmp_path: Path) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test", chunksize=2
+    )
+    sql_engine._to_sql(dataframe=otel_data)
+    sql_engine._to_sql(dataframe=otel_data)
+    df = sql_engine.to_pandas()
+    assert "index" not in df.columns
+    # Spans are keyed on (trace_id, span_id), so loading them twice is a no-op
+    assert len(df) == 3
+    assert df["parent_span_id"].isna().sum() == 1
+    with pytest.raises(ValueError):
+        sql_engine._to_sql(dataframe=otel_data, if_exists_policy="fail")
+    sql_engine._to_sql(dataframe=otel_data.iloc[:2], if_exists_policy="replace")
+    assert len(sql_engine.to_pandas()) == 2
+
+
+POSTGRES_URL = os.getenv("TRACES_SQL_URL") or os.getenv("BENCHMARK_POSTGRES_URL")
+
+
+@pytest.mark.skipif(
+    condition=not (POSTGRES_URL or "").startswith("postgresql"),
+    reason="Set TRACES_SQL_URL or BENCHMARK_POSTGRES_URL to a Postgres database",
+)
+def test_to_sql_copy(otel_data: pd.DataFrame, monkeypatch: pytest.MonkeyPatch) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=POSTGRES_URL, table_name="test_copy", chunksize=2
+    )
+    copied: List[int] = []
+    copy_chunk = sql_engine._copy_chunk
+
+    def counting_copy(connection: Any, chunk: pd.DataFrame, table_name: str) -> None:
+        copied.append(len(chunk))
+        copy_chunk(connection, chunk, table_name=table_name)
+
+    monkeypatch.setattr(sql_engine, "_copy_chunk", counting_copy)
+    sql_engine._to_sql(dataframe=otel_data, if_exists_policy="replace")
+    # Staged with COPY, one transaction per chunk
+    assert copied == [2, 1]
+    sql_engine._to_sql(dataframe=otel_data)
+    changed = otel_data.assign(duration=[150, 300, 900])
+    sql_engine._to_sql(dataframe=changed)
+    df = sql_engine.to_pandas().sort_values("span_id")
+    # Loading the spans again only updates them
+    assert df["span_id"].tolist() == ["span1", "span2", "span3"]
+    assert df["duration"].tolist() == [150, 300, 900]
+    assert sql_engine.latency_summary(granularity="1m")["span_count"].sum() == 3
+    schema = sql_engine.schema
+    with sql_engine.begin() as connection:
+        for table in [schema.traces, schema.sync_metadata, *schema.rollups.values()]:
+            table.drop(connection, checkfirst=True)
+    sql_engine.disconnect()
+
+
+def test_schema_migrates_legacy_table(otel_data: pd.DataFrame, tmp_path: Path) -> None:
+    engine = create_engine(f"sqlite:///{tmp_path / 'traces.db'}")
+    with engine.begin() as connection:
+        pd.concat([otel_data, otel_data]).to_sql("test", con=connection)
+    sql_engine = OtelTracesSqlEngine(engine=engine, table_name="test")
+    sql_engine.ensure_schema()
+    inspector = inspect(engine)
+    assert inspector.get_pk_constraint("test")["constrained_columns"] == [
+        "trace_id",
+        "span_id",
+    ]
+    assert {index["name"] for index in inspector.get_indexes("test")} == {
+        "ix_test_parent_span_id",
+        "ix_test_start_time_span_id",
+        "ix_test_tool_name_duration",
+        "ix_test_llm_model_duration",
+        "ix_test_total_tokens",
+    }
+    df = sql_engine.to_pandas()
+    assert len(df) == 3
+    assert "index" not in df.columns
+    assert df["attributes"].isna().all()
+
+
+def tool_span(span_id: str, duration: int, tags: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "spanID": span_id,
+        "operationName": "execute_tool",
+        "startTime": 1750618321000000 + duration,
+        "duration": duration,
+        "processID": "p1",
+        "references": [],
+        "tags": [{"key": key, "value": value} for key, value in tags.items()],
+        "logs": [],
+    }
+
+
+def test_span_attributes(tmp_path: Path) -> None:
+    engine = create_engine(f"sqlite:///{tmp_path / 'traces.db'}")
+    with engine.begin() as connection:
+        # A table created before the attribute columns existed
+        connection.execute(
+            text(
+                "CREATE TABLE test (trace_id TEXT, span_id TEXT, parent_span_id TEXT, "
+                "operation_name TEXT NOT NULL, start_time BIGINT NOT NULL, "
+                "duration BIGINT NOT NULL, status_code TEXT NOT NULL, "
+                "service_name TEXT NOT NULL, PRIMARY KEY (trace_id, span_id))"
+            )
+        )
+    sql_engine = OtelTracesSqlEngine(engine=engine, table_name="test")
+    answer = {"gen_ai.tool.name": "answer_questions_tool"}
+    spans = [
+        tool_span("slow", 900, {**answer, "llm.token_count.total": 5000}),
+        tool_span("slower", 1200, {**answer, "llm.token_count.total": 6000}),
+        tool_span("small", 2000, {**answer, "llm.token_count.total": 100}),
+        tool_span("cached", 10, {**answer, "answer.cache.hit": True}),
+        tool_span(
+            "llm",
+            300,
+            {
+                "gen_ai.request.model": "gpt-4.1",
+                "gen_ai.usage.input_tokens": "1200",
+                "gen_ai.usage.output_tokens": 300,
+                "otel.status_code": "ERROR",
+            },
+        ),
+    ]
+    spans[-1]["logs"] = [
+        {
+            "timestamp": 1750618321000100,
+            "fields": [{"key": "event", "value": "LLMChatStartEvent"}],
+        }
+    ]
+    data = {
+        "data": [
+            {
+                "traceID": "abc123",
+                "processes": {"p1": {"serviceName": "agent.traces"}},
+                "spans": spans,
+            }
+        ]
+    }
+    df = sql_engine._to_pandas(data)
+    assert df["tool_name"].tolist()[:4] == ["answer_questions_tool"] * 4
+    assert df["total_tokens"].tolist() == [5000, 6000, 100, pd.NA, 1500]
+    assert df["attributes"].iloc[3] == {**answer, "answer.cache.hit": True}
+    assert df["events"].iloc[4] == [
+        {"timestamp": 1750618321000100, "fields": {"event": "LLMChatStartEvent"}}
+    ]
+    assert df["status_code"].tolist() == ["", "", "", "", "ERROR"]
+
+    sql_engine._to_sql(dataframe=df)
+    slowest = sql_engine.filter_spans(
+        tool_name="answer_questions_tool", min_tokens=4000
+    )
+    assert slowest["span_id"].tolist() == ["slower", "slow"]
+    cached = sql_engine.filter_spans(attributes={"answer.cache.hit": True})
+    assert cached["span_id"].tolist() == ["cached"]
+    assert cached["attributes"].iloc[0] == {**answer, "answer.cache.hit": True}
+    llm = sql_engine.filter_spans(
+        llm_model="gpt-4.1", attributes={"gen_ai.usage.input_tokens": "1200"}
+    )
+    assert llm["input_tokens"].tolist() == [1200]
+    largest = sql_engine.filter_spans(order_by="total_tokens", limit=2)
+    assert largest["span_id"].tolist() == ["slower", "slow"]
+
+
+def test_incremental_sync(jaeger_data: Dict[str, Any], tmp_path: Path) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}",
+        table_name="test",
+        service_name="agent.traces",
+    )
+    requested_windows = []
+
+    def fake_export(
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        requested_windows.append((start_time, end_time))
+        return jaeger_data
+
+    sql_engine._export = fake_export  # type: ignore[method-assign]
+    assert sql_engine.get_high_water_mark() is None
+    sql_engine.to_sql_database(start_time=1, incremental=True)
+    sql_engine.to_sql_database(start_time=1, incremental=True, lookback=0)
+    assert requested_windows[0][0] == 1
+    assert requested_windows[1][0] == 1750618321000100
+    assert sql_engine.get_high_water_mark() == 1750618321000100
+    df = sql_engine.to_pandas()
+    assert len(df) == 2
+    assert sorted(df["span_id"]) == ["span1", "span2"]
+
+
+class JaegerStubHandler(BaseHTTPRequestHandler):
+    """Serves a recorded list of traces with Jaeger's time and limit filtering."""
+
+    traces: List[Dict[str, Any]] = []
+    requests: List[Dict[str, int]] = []
+
+    def do_GET(self) -> None:
+        query = {
+            k: int(v[0])
+            for k, v in parse_qs(urlparse(self.path).query).items()
+            if k != "service"
+        }
+        self.requests.append(query)
+        matching = [
+            trace
+            for trace in self.traces
+            if any(
+                query["start"] <= span["startTime"] <= query["end"]
+                for span in trace["spans"]
+            )
+        ]
+        body = json.dumps({"data": matching[-query["limit"] :]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture()
+def jaeger_stub() -> Iterator[str]:
+    JaegerStubHandler.traces = [
+        {
+            "traceID": f"trace{i}",
+            "processes": {"p1": {"serviceName": "agent.traces"}},
+            "spans": [
+                {
+                    "spanID": f"span{i}-{j}",
+                    "operationName": "FunctionAgent.run",
+                    "startTime": 1000 + i * 10 + j * 7,
+                    "duration": 5,
+                    "processID": "p1",
+                    "references": [],
+                    "tags": [],
+                }
+                for j in range(3)
+            ],
+        }
+        for i in range(50)
+    ]
+    JaegerStubHandler.requests = []
+    server = ThreadingHTTPServer(("localhost", 0), JaegerStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_port}/api/traces"
+    server.shutdown()
+
+
+def test_export_paginates(jaeger_stub: str) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine=create_engine("sqlite://"),
+        service_name="agent.traces",
+        jaeger_url=jaeger_stub,
+        max_workers=3,
+    )
+    data = sql_engine._export(start_time=1000, end_time=1600, limit=8)
+    assert len(JaegerStubHandler.requests) > 3
+    assert sorted(trace["traceID"] for trace in data["data"]) == sorted(
+        f"trace{i}" for i in range(50)
+    )
+    assert all(len(trace["spans"]) == 3 for trace in data["data"])
+    sql_engine.disconnect()
+
+
+def test_pagination(otel_data: pd.DataFrame, tmp_path: Path) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test"
+    )
+    sql_engine._to_sql(dataframe=otel_data)
+    first = sql_engine.fetch_page(page_size=2)
+    assert first["span_id"].tolist() == ["span3", "span2"]
+    last_key = (int(first["start_time"].iloc[-1]), first["span_id"].iloc[-1])
+    second = sql_engine.fetch_page(page_size=2, before=last_key)
+    assert second["span_id"].tolist() == ["span1"]
+    recent = sql_engine.fetch_page(page_size=10, start_time=1750618321000100)
+    assert recent["span_id"].tolist() == ["span3", "span2"]
+    page = sql_engine.query_page(
+        "SELECT span_id FROM test ORDER BY span_id;", page=1, page_size=2
+    )
+    assert page["span_id"].tolist() == ["span3"]
+    pages = list(sql_engine.iter_query("SELECT * FROM test", page_size=2))
+    assert [len(page) for page in pages] == [2, 1]
+    # A time range on an engine that has not connected yet
+    reader = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test"
+    )
+    recent = reader.query_page(
+        "SELECT span_id FROM test ORDER BY span_id", start_time=1750618321000100
+    )
+    assert recent["span_id"].tolist() == ["span2", "span3"]
+    reader.disconnect()
+
+
+def test_concurrent_reads_and_writes(otel_data: pd.DataFrame, tmp_path: Path) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test"
+    )
+    sql_engine.ensure_schema()
+
+    def write(worker: int) -> None:
+        batch = otel_data.copy()
+        batch["span_id"] = [f"w{worker}-{span_id}" for span_id in batch["span_id"]]
+        sql_engine._upsert(
+            dataframe=batch.reindex(columns=list(TRACES_DTYPES)).astype(TRACES_DTYPES)
+        )
+
+    def read(_: int) -> None:
+        sql_engine.fetch_page(page_size=5)
+        sql_engine.execute(text("SELECT COUNT(*) FROM test"))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(write, worker) for worker in range(10)]
+        futures += [executor.submit(read, worker) for worker in range(10)]
+        for future in futures:
+            future.result()
+    count = sql_engine.execute(text("SELECT COUNT(*) FROM test"), return_pandas=True)
+    assert count.iloc[0, 0] == 30
+    sql_engine.disconnect()
+
+
+def test_query_cache(otel_data: pd.DataFrame, tmp_path: Path) -> None:
+    engine_url = f"sqlite:///{tmp_path / 'traces.db'}"
+    sql_engine = OtelTracesSqlEngine(engine_url=engine_url, table_name="test")
+    sql_engine._to_sql(dataframe=otel_data.iloc[:2])
+    query = "SELECT COUNT(*) AS spans FROM test;"
+    assert sql_engine.execute(query, return_pandas=True)["spans"].tolist() == [2]
+    cached = sql_engine.execute(
+        "\n  SELECT COUNT(*) AS spans FROM test ; ", return_pandas=True
+    )
+    assert cached["spans"].tolist() == [2]
+    assert sql_engine._query_cache.hits == 1
+    # Whitespace inside a string literal is part of the query
+    literal = "SELECT COUNT(*) AS spans FROM test WHERE operation_name = '{}'"
+    name = "ServiceA.query_db"
+    assert sql_engine.execute(literal.format(name), return_pandas=True)[
+        "spans"
+    ].tolist() == [1]
+    spaced = literal.format(name.replace(".", " .  "))
+    assert sql_engine.execute(spaced, return_pandas=True)["spans"].tolist() == [0]
+    assert sql_engine._query_cache.hits == 1
+    # Another writer, e.g. the ingestion worker in a different process
+    writer = OtelTracesSqlEngine(engine_url=engine_url, table_name="test")
+    writer._upsert(dataframe=otel_data.iloc[2:])
+    assert sql_engine.execute(query, return_pandas=True)["spans"].tolist() == [3]
+    assert sql_engine._query_cache.hits == 1
+    sql_engine._to_sql(dataframe=otel_data.iloc[:1], if_exists_policy="replace")
+    assert sql_engine.execute(query, return_pandas=True)["spans"].tolist() == [1]
+    writer.disconnect()
+    sql_engine.disconnect()
+
+
+def test_ddsketch_quantiles() -> None:
+    values = np.random.default_rng(seed=0).lognormal(mean=8, sigma=1, size=10000)
+    sketch = DDSketch().add(values[:5000])
+    sketch.merge(DDSketch.from_json(DDSketch().add(values[5000:]).to_json()))
+    assert sketch.count == 10000
+    for q in (0.5, 0.95, 0.99):
+        assert sketch.quantile(q) == pytest.approx(np.quantile(values, q), rel=0.02)
+
+
+def test_latency_rollups(otel_data: pd.DataFrame, tmp_path: Path) -> None:
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}", table_name="test"
+    )
+    sql_engine._to_sql(dataframe=otel_data.iloc[:2])
+    # Spans that were already ingested are not counted twice, but updated
+    sql_engine._upsert(dataframe=otel_data.assign(parent_span_id="root"))
+    parents = sql_engine.execute(
+        "SELECT DISTINCT parent_span_id FROM test", return_pandas=True
+    )
+    assert parents["parent_span_id"].tolist() == ["root"]
+    summary = sql_engine.latency_summary(granularity="1m").set_index("operation_name")
+    assert summary["span_count"].sum() == 3
+    assert summary.loc["ServiceA.query_db", "p50_duration"] == pytest.approx(
+        300, rel=0.01
+    )
+    hourly = sql_engine.latency_summary(granularity="1h")
+    assert hourly["span_count"].sum() == 3
+    # Rollup tables created over existing spans are backfilled
+    sql_engine.execute(text("DROP TABLE test_rollup_1h"))
+    sql_engine.ensure_schema()
+    assert sql_engine.latency_summary(granularity="1h")["span_count"].sum() == 3
+    sql_engine.disconnect()
+
+
+def test_archive_routing(tmp_path: Path) -> None:
+    day = 24 * 60 * 60 * 1000000
+    first_day = 1750550400000000  # 2025-06-22T00:00:00Z
+    spans = pd.DataFrame(
+        {
+            "trace_id": [f"t{i}" for i in range(6)],
+            "span_id": [f"s{i}" for i in range(6)],
+            "parent_span_id": [None] * 6,
+            "operation_name": ["A", "B"] * 3,
+            # Two spans on each of three days
+            "start_time": [first_day + (i // 2) * day + i * 1000 for i in range(6)],
+            "duration": [100, 200, 300, 400, 500, 600],
+            "status_code": ["OK"] * 6,
+            "service_name": ["agent.traces"] * 6,
+        }
+    )
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=f"sqlite:///{tmp_path / 'traces.db'}",
+        table_name="test",
+        archive_dir=str(tmp_path / "archive"),
+    )
+    sql_engine._to_sql(dataframe=spans)
+    assert sql_engine.route() == "database"
+    written = sql_engine.archive_partitions(
+        before=first_day + 2 * day + 1, batch_size=1
+    )
+    assert [Path(path).name for path in written] == [
+        "day=2025-06-22",
+        "day=2025-06-23",
+    ]
+    assert sql_engine.get_archived_until() == first_day + 2 * day
+    remaining = sql_engine.execute("SELECT span_id FROM test", return_pandas=True)
+    assert remaining["span_id"].tolist() == ["s4", "s5"]
+
+    assert sql_engine.route(start_time=first_day + 2 * day) == "database"
+    # The time range applies on every route
+    recent = sql_engine.query_traces(
+        "WITH spans AS (SELECT span_id FROM test) SELECT * FROM spans",
+        start_time=first_day + 2 * day,
+        end_time=first_day + 2 * day + 4000,
+    )
+    assert recent["span_id"].tolist() == ["s4"]
+    assert sql_engine.route(end_time=first_day + day) == "archive"
+    assert sql_engine.route() == "both"
+    query = (
+        "SELECT operation_name, COUNT(*) AS spans, SUM(duration) AS duration "
+        "FROM test GROUP BY operation_name ORDER BY operation_name"
+    )
+    # The whole history: archived and recent spans together
+    both = sql_engine.query_traces(query)
+    assert both["spans"].tolist() == [3, 3]
+    assert both["duration"].tolist() == [900, 1200]
+    # Only the second day is read from the archive
+    archived = sql_engine.query_traces(
+        "SELECT span_id FROM test ORDER BY span_id",
+        start_time=first_day + day,
+        end_time=first_day + 2 * day - 1,
+    )
+    assert archived["span_id"].tolist() == ["s2", "s3"]
+    assert sql_engine._archive_files(first_day + day, first_day + 2 * day - 1) == [
+        str(tmp_path / "archive" / "test" / "day=2025-06-23" / "part-00000.parquet")
+    ]
+    page = sql_engine.query_traces(
+        "SELECT span_id FROM test ORDER BY span_id", page=1, page_size=4
+    )
+    assert page["span_id"].tolist() == ["s4", "s5"]
+
+    # Spans stored after their day was archived are archived by the next run
+    late = spans.iloc[[2, 0]].assign(
+        trace_id=["t2", "t0"], span_id=["late", "s0"], duration=[50, 1000]
+    )
+    sql_engine._to_sql(dataframe=late)
+    written = sql_engine.archive_partitions(
+        before=first_day + 2 * day + 1, batch_size=1
+    )
+    assert [Path(path).name for path in written] == [
+        "day=2025-06-22",
+        "day=2025-06-23",
+    ]
+    remaining = sql_engine.execute("SELECT span_id FROM test", return_pandas=True)
+    assert remaining["span_id"].tolist() == ["s4", "s5"]
+    both = sql_engine.query_traces(query)
+    assert both["spans"].tolist() == [4, 3]
+    # The new version of s0 replaced the archived one
+    assert both["duration"].tolist() == [1850, 1200]
+    sql_engine.disconnect()
@@ -0,0 +1,119 @@
+import sys
+import os
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+import pandas as pd
+
+from src.agents_observability_demo.utils import (
+    OtelTracesSqlEngine,
+    ROLLUP_SPAN_COLUMNS,
+    TRACES_DTYPES,
+)
+
+
+def make_spans(n_rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed=42)
+    span_ids = [f"{i:016x}" for i in range(n_rows)]
+    return (
+        pd.DataFrame(
+            {
+                "trace_id": [f"{i // 20:032x}" for i in range(n_rows)],
+                "span_id": span_ids,
+                "parent_span_id": [
+                    None if i % 20 == 0 else span_ids[i - 1] for i in range(n_rows)
+                ],
+                "operation_name": rng.choice(
+                    ["FunctionAgent.run", "OpenAI.achat", "BasicMCPClient.call_tool"],
+                    n_rows,
+                ),
+                "start_time": 1750618321000000 + np.arange(n_rows, dtype="int64") * 100,
+                "duration": rng.integers(10, 5_000_000, n_rows),
+                "status_code": rng.choice(["OK", "ERROR", ""], n_rows),
+                "service_name": "agent.traces",
+            }
+        )
+        .reindex(columns=list(TRACES_DTYPES))
+        .astype(TRACES_DTYPES)
+    )
+
+
+def timed(label: str, n_rows: int, fn) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.3f}s {n_rows / elapsed:12,.0f} rows/s")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare DataFrame.to_sql with OtelTracesSqlEngine._to_sql"
+    )
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--chunksize", type=int, default=10_000)
+    parser.add_argument(
+        "--engine-url",
+        default=None,
+        help="SQLAlchemy URL to benchmark against (defaults to a temporary SQLite file)",
+    )
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    engine_url = (
+        args.engine_url or f"sqlite:///{os.path.join(tmp_dir.name, 'bench.db')}"
+    )
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=engine_url, table_name="bench_traces", chunksize=args.chunksize
+    )
+    df = make_spans(args.rows)
+    print(f"Loading {args.rows:,} spans into {sql_engine._engine.dialect.name}")
+
+    def reset() -> None:
+        # An empty traces table (and rollups) before each run
+        sql_engine._to_sql(dataframe=df.iloc[:0], if_exists_policy="replace")
+
+    def legacy() -> None:
+        # The same work as _to_sql: the same keyed table and the same rollups,
+        # one transaction per chunk, with the rows written by DataFrame.to_sql
+        for start in range(0, len(df), args.chunksize):
+            chunk = df.iloc[start : start + args.chunksize]
+            with sql_engine.begin() as connection:
+                chunk.to_sql(
+                    name="bench_traces", con=connection, if_exists="append", index=False
+                )
+                sql_engine._write_rollups(
+                    connection, sql_engine._rollup_rows(chunk[ROLLUP_SPAN_COLUMNS])
+                )
+
+    reset()
+    baseline = timed("DataFrame.to_sql (default)", args.rows, legacy)
+    reset()
+    bulk = timed(
+        "OtelTracesSqlEngine._to_sql",
+        args.rows,
+        lambda: sql_engine._to_sql(dataframe=df),
+    )
+    print(f"Speedup: {baseline / bulk:.2f}x")
+    # Every span is known: only the spans whose values changed are rewritten
+    timed(
+        "_to_sql, same spans again",
+        args.rows,
+        lambda: sql_engine._to_sql(dataframe=df),
+    )
+
+    schema = sql_engine.schema
+    with sql_engine.begin() as connection:
+        for table in [schema.traces, schema.sync_metadata, *schema.rollups.values()]:
+            table.drop(connection, checkfirst=True)
+    sql_engine.disconnect()
+    tmp_dir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+import sys
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import tracemalloc
+import multiprocessing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from src.agents_observability_demo.utils import OtelTracesSqlEngine
+from synthetic_traces import FakeJaeger, generate_traces, time_range
+
+STAGES = ["to_pandas", "to_sql", "to_sql_database"]
+# Stages that don't touch the database only run once, against "none"
+DATABASE_STAGES = {"to_sql", "to_sql_database"}
+
+
+def current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def peak_rss() -> int:
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class RssSampler:
+    """Samples the resident set size in the background, keeping its peak."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak or 0, current_rss() or 0)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak or 0, current_rss() or 0)
+
+
+def measure(fn: Callable[[], Any], allocations: bool) -> Dict[str, Any]:
+    gc.collect()
+    rss_before = current_rss()
+    with RssSampler() as sampler:
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+    result: Dict[str, Any] = {
+        "seconds": seconds,
+        "rss_before_bytes": rss_before,
+        "peak_rss_bytes": sampler.peak if rss_before is not None else peak_rss(),
+        "peak_allocated_bytes": None,
+    }
+    if allocations:
+        # A second run, as tracing allocations slows everything down
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        result["peak_allocated_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs one stage on one backend, in a process of its own."""
+    payload = generate_traces(case["spans"], **case["shape"])
+    spans = sum(len(trace["spans"]) for trace in payload["data"])
+    tmp_dir = tempfile.TemporaryDirectory()
+    engine_url = case["engine_url"] or f"sqlite:///{tmp_dir.name}/bench.db"
+    sql_engine = OtelTracesSqlEngine(
+        engine_url=engine_url,
+        table_name="bench_traces",
+        service_name="agent.traces",
+        chunksize=case["chunksize"],
+    )
+    try:
+        if case["stage"] == "to_pandas":
+            result = measure(
+                lambda: sql_engine._to_pandas(payload), case["allocations"]
+            )
+        elif case["stage"] == "to_sql":
+            df = sql_engine._to_pandas(payload)
+            result = measure(
+                lambda: sql_engine._to_sql(dataframe=df, if_exists_policy="replace"),
+                case["allocations"],
+            )
+        else:
+            start_time, end_time = time_range(payload)
+            with FakeJaeger(payload) as jaeger:
+                sql_engine.jaeger_url = jaeger.url
+                result = measure(
+                    lambda: sql_engine.to_sql_database(
+                        start_time=start_time,
+                        end_time=end_time,
+                        limit=1000,
+                        if_exists_policy="replace",
+                    ),
+                    case["allocations"],
+                )
+    finally:
+        if case["stage"] in DATABASE_STAGES:
+            with sql_engine.begin() as connection:
+                sql_engine.schema.metadata.drop_all(connection)
+        sql_engine.disconnect()
+        tmp_dir.cleanup()
+    return {
+        "backend": case["backend"],
+        "stage": case["stage"],
+        "spans": spans,
+        "traces": len(payload["data"]),
+        **result,
+        "spans_per_second": spans / result["seconds"],
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline_path: str, tolerance: float
+) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {
+            (result["backend"], result["stage"], result["spans"]): result
+            for result in json.load(f)["results"]
+        }
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["backend"], result["stage"], result["spans"]))
+        if previous is None:
+            continue
+        ratio = result["spans_per_second"] / previous["spans_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(
+                f"{result['stage']} on {result['backend']} with {result['spans']:,} "
+                f"spans: {ratio:.0%} of the baseline throughput"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark _to_pandas, _to_sql and to_sql_database on synthetic Jaeger payloads"
+    )
+    parser.add_argument(
+        "--spans",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="Payload sizes to benchmark, in spans (up to 1,000,000)",
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--fan-out", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--tags", type=int, default=4, help="Tags per span")
+    parser.add_argument(
+        "--tag-cardinality", type=int, default=100, help="Distinct values per tag"
+    )
+    parser.add_argument("--chunksize", type=int, default=10_000)
+    parser.add_argument(
+        "--postgres-url",
+        default=os.getenv("BENCHMARK_POSTGRES_URL"),
+        help="SQLAlchemy URL of a local Postgres to benchmark too (SQLite only by default)",
+    )
+    parser.add_argument(
+        "--allocations",
+        action="store_true",
+        help="Also record the peak of traced allocations (runs every stage twice)",
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument(
+        "--baseline", help="Results of a previous run to check for regressions"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Throughput drop (as a fraction) that counts as a regression",
+    )
+    args = parser.parse_args()
+
+    backends: Dict[str, Optional[str]] = {"sqlite": None}
+    if args.postgres_url:
+        backends["postgresql"] = args.postgres_url
+    shape = {
+        "fan_out": args.fan_out,
+        "depth": args.depth,
+        "tags": args.tags,
+        "tag_cardinality": args.tag_cardinality,
+    }
+    cases = [
+        {
+            "backend": backend if stage in DATABASE_STAGES else "none",
+            "engine_url": engine_url,
+            "stage": stage,
+            "spans": spans,
+            "shape": shape,
+            "chunksize": args.chunksize,
+            "allocations": args.allocations,
+        }
+        for spans in args.spans
+        for stage in args.stages
+        for backend, engine_url in backends.items()
+        if stage in DATABASE_STAGES or backend == "sqlite"
+    ]
+
+    results = []
+    print(
+        f"{'stage':<16} {'backend':<11} {'spans':>10} {'seconds':>9} {'spans/s':>12} {'peak RSS':>10}"
+    )
+    for case in cases:
+        # A fresh process per case, so that peak memory isn't inherited
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            result = pool.submit(run_case, case).result()
+        results.append(result)
+        print(
+            f"{result['stage']:<16} {result['backend']:<11} {result['spans']:>10,} "
+            f"{result['seconds']:>9.3f} {result['spans_per_second']:>12,.0f} "
+            f"{result['peak_rss_bytes'] / 2**20:>8.0f}MB"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "parameters": {**shape, "chunksize": args.chunksize},
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import json
+import threading
+
+import numpy as np
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+OPERATIONS = [
+    "FunctionAgent.run",
+    "FunctionAgent.take_step",
+    "OpenAI.achat",
+    "BasicMCPClient.call_tool",
+    "LlamaExtract.aextract",
+    "QueryEngine.aquery",
+]
+START_TIME = 1750618321000000
+
+
+def spans_per_trace(fan_out: int, depth: int) -> int:
+    """Number of spans in a full trace tree of the given fan-out and depth."""
+    return sum(fan_out**level for level in range(depth))
+
+
+def generate_traces(
+    spans: int,
+    fan_out: int = 3,
+    depth: int = 4,
+    tags: int = 4,
+    tag_cardinality: int = 100,
+    error_rate: float = 0.05,
+    service_name: str = "agent.traces",
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """
+    Builds a Jaeger `/api/traces` payload with `spans` spans in total. Each
+    trace is a tree where every span has `fan_out` children, down to `depth`
+    levels (the last trace is cut short to hit the span count exactly).
+    Every span carries `tags` tags, whose values are drawn from
+    `tag_cardinality` distinct values per tag.
+    """
+    rng = np.random.default_rng(seed)
+    per_trace = spans_per_trace(fan_out, depth)
+    operations = rng.integers(0, len(OPERATIONS), spans)
+    durations = rng.integers(10, 5_000_000, spans)
+    tag_values = rng.integers(0, tag_cardinality, (spans, tags))
+    errors = rng.random(spans) < error_rate
+    traces: List[Dict[str, Any]] = []
+    for first in range(0, spans, per_trace):
+        trace_id = f"{first // per_trace:032x}"
+        trace_start = START_TIME + (first // per_trace) * 10_000_000
+        trace_spans: List[Dict[str, Any]] = []
+        for position in range(min(per_trace, spans - first)):
+            index = first + position
+            span_tags = [
+                {"key": f"tag.{i}", "type": "string", "value": f"value-{value}"}
+                for i, value in enumerate(tag_values[index])
+            ]
+            span_tags.append(
+                {
+                    "key": "otel.status_code",
+                    "type": "string",
+                    "value": "ERROR" if errors[index] else "OK",
+                }
+            )
+            references = []
+            if position > 0:
+                # Breadth-first numbering: the parent of node n is (n - 1) // fan_out
+                parent = first + (position - 1) // fan_out
+                references.append(
+                    {
+                        "refType": "CHILD_OF",
+                        "traceID": trace_id,
+                        "spanID": f"{parent:016x}",
+                    }
+                )
+            trace_spans.append(
+                {
+                    "traceID": trace_id,
+                    "spanID": f"{index:016x}",
+                    "operationName": OPERATIONS[operations[index]],
+                    "references": references,
+                    "startTime": trace_start + position * 100,
+                    "duration": int(durations[index]),
+                    "tags": span_tags,
+                    "logs": [],
+                    "processID": "p1",
+                    "warnings": None,
+                }
+            )
+        traces.append(
+            {
+                "traceID": trace_id,
+                "spans": trace_spans,
+                "processes": {"p1": {"serviceName": service_name, "tags": []}},
+                "warnings": None,
+            }
+        )
+    return {"data": traces}
+
+
+def time_range(payload: Dict[str, Any]) -> Tuple[int, int]:
+    """Start and end (exclusive) of the traces in a payload, in microseconds."""
+    starts = [trace["spans"][0]["startTime"] for trace in payload["data"]]
+    return min(starts), max(starts) + 1
+
+
+class FakeJaeger:
+    """
+    Serves a payload over HTTP like Jaeger's `/api/traces`: the traces whose
+    root span starts in [start, end), at most `limit` of them. Use as a
+    context manager; `url` is the endpoint to point `jaeger_url` to.
+    """
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.traces = sorted(
+            payload["data"], key=lambda trace: trace["spans"][0]["startTime"]
+        )
+        self.starts = np.array(
+            [trace["spans"][0]["startTime"] for trace in self.traces], dtype="int64"
+        )
+        self.requests = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def query(self, start: int, end: int, limit: int) -> List[Dict[str, Any]]:
+        first, last = np.searchsorted(self.starts, [start, end])
+        return self.traces[first : min(last, first + limit)]
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]  # type: ignore[union-attr]
+        return f"http://{host}:{port}/api/traces"
+
+    def __enter__(self) -> "FakeJaeger":
+        jaeger = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                params = parse_qs(urlparse(self.path).query)
+                traces = jaeger.query(
+                    int(params["start"][0]),
+                    int(params["end"][0]),
+                    int(params["limit"][0]),
+                )
+                jaeger.requests += 1
+                body = json.dumps({"data": traces}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._server.shutdown()  # type: ignore[union-attr]
+        self._server.server_close()  # type: ignore[union-attr]